@@ -0,0 +1,83 @@
+"""Headless batch runner: generate content from a JSONL file of jobs without a Streamlit session.
+
+Each line of the jobs file is one JSON object, for example::
+
+    {"id": "city-night", "mode": "snapshot", "provider": "Flux", "prompt": "A city at night", "params": {"num_images": 24, "fps": 12, "aspect_ratio": "16:9"}}
+    {"id": "bear", "mode": "luma", "prompt": "A teddy bear playing guitar", "params": {"aspect_ratio": "16:9"}}
+
+Modes are snapshot, image, text-to-video, image-to-video, runwayml and luma
+(see ``engine.run_job`` for the parameters each takes). API keys are read from
+STABILITY_API_KEY, OPENAI_API_KEY, REPLICATE_API_TOKEN, RUNWAYML_API_SECRET and
+LUMAAI_API_KEY. Outputs go to ``<output-dir>/<job id>/`` and one result record
+per job is appended to the manifest as soon as the job finishes. Video
+generations are recorded in the job store (``LOOM_JOB_DIR``), so running an
+interrupted batch again continues its Text-to-Video chains and reattaches to
+its RunwayML and Luma generations instead of paying for new ones.
+
+Usage::
+
+    python batch.py jobs.jsonl --output-dir batch_output --concurrency 4
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+
+from engine import run_batch
+from jobs import get_job_store
+from providers import environment_api_keys
+
+
+def read_jobs(path):
+    jobs = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                job = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise SystemExit(f"{path}:{line_number}: invalid JSON: {e}")
+            job.setdefault("id", f"job_{line_number}")
+            jobs.append(job)
+    return jobs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run Loom generation jobs from a JSONL file without the UI.")
+    parser.add_argument("jobs", help="JSONL file with one job per line")
+    parser.add_argument("--output-dir", default="batch_output", help="directory for job outputs (default: batch_output)")
+    parser.add_argument("--concurrency", type=int, default=2, help="jobs to run at the same time (default: 2)")
+    parser.add_argument("--manifest", help="results manifest path (default: <output-dir>/manifest.jsonl)")
+    parser.add_argument("--no-resume", action="store_true", help="do not record generations in the job store or resume interrupted chains")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log progress messages as well as problems")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format="%(asctime)s %(levelname)s %(message)s"
+    )
+    jobs = read_jobs(args.jobs)
+    api_keys = environment_api_keys()
+    os.makedirs(args.output_dir, exist_ok=True)
+    manifest_path = args.manifest or os.path.join(args.output_dir, "manifest.jsonl")
+
+    failed = 0
+    with open(manifest_path, "w", encoding="utf-8") as manifest:
+        job_store = None if args.no_resume else get_job_store()
+        for record in run_batch(jobs, args.output_dir, api_keys, concurrency=args.concurrency, job_store=job_store):
+            manifest.write(json.dumps(record, ensure_ascii=False) + "\n")
+            manifest.flush()
+            if record["status"] != "succeeded":
+                failed += 1
+            print(f"{record['status']:>9}  {record['id']}  {record['seconds']:.1f}s", flush=True)
+
+    print(f"{len(jobs) - failed}/{len(jobs)} jobs succeeded; manifest written to {manifest_path}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
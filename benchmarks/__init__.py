@@ -0,0 +1 @@
+"""Benchmarks for Loom against local mock provider servers; run with ``python -m benchmarks.run``."""
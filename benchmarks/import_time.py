@@ -0,0 +1,142 @@
+"""Check the import cost of a fresh Loom worker process against a budget.
+
+    python -m benchmarks.import_time --repeat 5 --output import_time.json
+
+Every measurement runs in a new interpreter, as a new Streamlit worker would.
+Each entry module must import within its budget (median seconds) and must
+not pull in any of ``LAZY_MODULES``, which are only to be loaded on first
+use. The cost of that first use is measured per provider SDK as well. Exits
+with status 1 when a budget is exceeded or a lazy module was imported eagerly.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Median seconds allowed for importing each entry module in a fresh interpreter
+DEFAULT_BUDGETS = {
+    "engine": 0.3,
+    "main": 0.8,
+    "batch": 0.3,
+}
+
+# Modules that must only be imported when a session actually uses them
+LAZY_MODULES = ("lumaai", "runwayml", "replicate", "moviepy", "cv2", "numpy")
+
+# Provider SDKs whose first use is timed
+SDK_PROVIDERS = ("replicate", "runwayml", "luma")
+
+_IMPORT_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - started
+print(json.dumps({{"seconds": seconds, "loaded": [m for m in {lazy!r} if m in sys.modules]}}))
+"""
+
+_SDK_PROBE = """
+import json, time
+import providers
+started = time.perf_counter()
+providers.sdk({provider!r})
+print(json.dumps({{"seconds": time.perf_counter() - started}}))
+"""
+
+
+def _probe(code):
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, capture_output=True, encoding="utf-8", errors="replace"
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip())
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(module, count=10):
+    """Return the ``count`` imports with the largest cumulative time when importing ``module``, per ``-X importtime``."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, encoding="utf-8", errors="replace",
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        # "import time:  self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        rows.append({"module": name.strip(), "cumulative_seconds": int(cumulative) / 1e6})
+    rows.sort(key=lambda row: row["cumulative_seconds"], reverse=True)
+    return rows[:count]
+
+
+def summarize(runs):
+    return {"min": min(runs), "median": statistics.median(runs), "mean": statistics.mean(runs), "runs": runs}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per measurement")
+    parser.add_argument("--budget", action="append", default=[], metavar="MODULE=SECONDS",
+                        help="override or add an import budget, e.g. main=1.0")
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    args = parser.parse_args(argv)
+
+    budgets = dict(DEFAULT_BUDGETS)
+    for item in args.budget:
+        module, _, seconds = item.partition("=")
+        budgets[module.strip()] = float(seconds)
+
+    results = []
+    failures = []
+    for module, budget in budgets.items():
+        probes = [_probe(_IMPORT_PROBE.format(module=module, lazy=LAZY_MODULES)) for _ in range(args.repeat)]
+        seconds = summarize([probe["seconds"] for probe in probes])
+        loaded = sorted({name for probe in probes for name in probe["loaded"]})
+        if seconds["median"] > budget:
+            failures.append(f"import {module} took {seconds['median']:.3f}s, budget {budget:.3f}s")
+        if loaded:
+            failures.append(f"import {module} eagerly loaded {', '.join(loaded)}")
+        results.append({
+            "name": "import",
+            "params": {"module": module},
+            "seconds": seconds,
+            "budget_seconds": budget,
+            "eager_lazy_modules": loaded,
+            "slowest_imports": slowest_imports(module),
+        })
+
+    for provider in SDK_PROVIDERS:
+        runs = [_probe(_SDK_PROBE.format(provider=provider))["seconds"] for _ in range(args.repeat)]
+        results.append({"name": "sdk_first_use", "params": {"provider": provider}, "seconds": summarize(runs)})
+
+    document = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "repeat": args.repeat,
+        },
+        "results": results,
+        "failures": failures,
+    }
+    text = json.dumps(document, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,344 @@
+"""Local stand-ins for the provider HTTP APIs Loom calls.
+
+One threaded HTTP server answers the Stability v1 text-to-image and v2beta
+image-to-video endpoints, OpenAI image generations, Replicate model
+predictions, RunwayML image-to-video tasks and Luma generations, plus the
+asset URLs they hand out. A ``Profile`` sets how long each answer takes,
+how many status checks a job stays pending for (202 / "processing"), and
+how often requests fail. ``install`` points Loom's transport and the
+provider SDKs at the server.
+"""
+
+import base64
+import collections
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+import transport
+from video import encode_frames
+
+# Hosts Loom calls through its own transport; the SDKs are routed by environment variable
+TRANSPORT_HOSTS = ("api.stability.ai", "api.openai.com", "replicate.delivery")
+# The Replicate SDK only wraps https outputs in FileOutput, so its outputs use
+# the real delivery host, which the transport then routes here
+REPLICATE_DELIVERY_URL = "https://replicate.delivery"
+
+
+@dataclass
+class Profile:
+    latency: float = 0.05  # seconds before every API answer
+    jitter: float = 0.0  # latency varies uniformly by +- this many seconds
+    pending_polls: int = 2  # status checks a job stays pending for before it completes
+    generation_time: float = 0.0  # seconds a job takes at the provider before it can complete
+    error_rate: float = 0.0  # share of API requests answered with error_status
+    error_status: int = 500
+    retry_after: float = None  # sent as Retry-After with injected errors, if set
+    asset_latency: float = 0.0  # seconds before a generated file (/files/...) is served
+
+
+def _noise_png(size):
+    # Noise keeps the PNG close to the size of a real generated image
+    image = Image.effect_noise(size, 64).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _sample_video(size, frames=25, fps=25):
+    path = os.path.join(tempfile.mkdtemp(prefix="loom_mock_"), "sample.mp4")
+    encode_frames(
+        (Image.new("RGB", size, (i * 10 % 256, 96, 160)) for i in range(frames)), fps, path, preset="ultrafast"
+    )
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class MockProviders:
+    def __init__(self, profile=None, image_size=(512, 512), video_size=(512, 512)):
+        self.profile = profile or Profile()
+        self.image = _noise_png(image_size)
+        self.video = _sample_video(video_size)
+        self.requests = collections.Counter()
+        self.canceled = set()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._environ = {}
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        handler = type("Handler", (_Handler,), {"mock": self})
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="mock-providers", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.uninstall()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def install(self):
+        """Route Loom's provider calls to this server until ``uninstall``."""
+        environ = {
+            "REPLICATE_BASE_URL": self.base_url,
+            "RUNWAYML_BASE_URL": self.base_url,
+            "LUMAAI_BASE_URL": f"{self.base_url}/dream-machine/v1",
+            "REPLICATE_POLL_INTERVAL": "0.05",
+        }
+        self._environ = {name: os.environ.get(name) for name in environ}
+        os.environ.update(environ)
+        for host in TRANSPORT_HOSTS:
+            transport.API_BASE_URLS[host] = self.base_url
+
+    def uninstall(self):
+        for name, value in self._environ.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        self._environ = {}
+        for host in TRANSPORT_HOSTS:
+            transport.API_BASE_URLS.pop(host, None)
+
+    def __enter__(self):
+        self.start().install()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def new_job(self):
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[job_id] = (self.profile.pending_polls, time.monotonic() + self.profile.generation_time)
+        return job_id
+
+    def poll(self, job_id):
+        """Return True once ``job_id`` has been checked often enough, and run long enough, to be complete."""
+        with self._lock:
+            remaining, ready_at = self._jobs.get(job_id, (0, 0.0))
+            if remaining <= 0 and time.monotonic() >= ready_at:
+                return True
+            self._jobs[job_id] = (max(remaining - 1, 0), ready_at)
+            return False
+
+
+class _Handler(BaseHTTPRequestHandler):
+    mock = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b"", content_type="application/json", headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        data = self.rfile.read(length) if length else b""
+        if self.headers.get("Content-Type", "").startswith("application/json") and data:
+            return json.loads(data)
+        return {}
+
+    def _file_url(self, name):
+        return f"{self.mock.base_url}/files/{name}"
+
+    def _delay(self):
+        profile = self.mock.profile
+        delay = profile.latency + random.uniform(-profile.jitter, profile.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _inject_error(self):
+        profile = self.mock.profile
+        if profile.error_rate <= 0 or random.random() >= profile.error_rate:
+            return False
+        headers = {"Retry-After": str(profile.retry_after)} if profile.retry_after is not None else None
+        self._send(profile.error_status, {"error": {"message": "injected error"}}, headers=headers)
+        return True
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def _handle(self, method):
+        path = self.path.split("?", 1)[0]
+        body = self._body() if method == "POST" else {}
+        if path.startswith("/files/"):
+            self.mock.requests["files"] += 1
+            if self.mock.profile.asset_latency > 0:
+                time.sleep(self.mock.profile.asset_latency)
+            if path.endswith(".png"):
+                return self._send(200, self.mock.image, "image/png")
+            return self._send(200, self.mock.video, "video/mp4")
+
+        route = self._route(method, path)
+        if route is None:
+            return self._send(404, {"error": f"no mock for {method} {path}"})
+        name, handler, args = route
+        self.mock.requests[name] += 1
+        self._delay()
+        if self._inject_error():
+            return
+        handler(body, *args)
+
+    def _route(self, method, path):
+        parts = path.strip("/").split("/")
+        if method == "POST" and path == "/v1beta/generation/stable-diffusion-v1-6/text-to-image":
+            return "stability_text_to_image", self._stability_image, ()
+        if method == "POST" and path == "/v2beta/image-to-video":
+            return "stability_image_to_video", self._stability_start, ()
+        if method == "GET" and path.startswith("/v2beta/image-to-video/result/"):
+            return "stability_result", self._stability_result, (parts[-1],)
+        if method == "POST" and path == "/v1/images/generations":
+            return "openai_images", self._openai_images, ()
+        if method == "POST" and len(parts) == 5 and parts[:2] == ["v1", "models"] and parts[4] == "predictions":
+            return "replicate_create", self._replicate_create, (f"{parts[2]}/{parts[3]}",)
+        if method == "GET" and len(parts) == 3 and parts[:2] == ["v1", "predictions"]:
+            return "replicate_get", self._replicate_get, (parts[2],)
+        if method == "POST" and len(parts) == 4 and parts[:2] == ["v1", "predictions"] and parts[3] == "cancel":
+            return "replicate_cancel", self._replicate_cancel, (parts[2],)
+        if method == "POST" and path == "/v1/image_to_video":
+            return "runwayml_create", self._runwayml_create, ()
+        if method == "GET" and len(parts) == 3 and parts[:2] == ["v1", "tasks"]:
+            return "runwayml_task", self._runwayml_task, (parts[2],)
+        if method == "GET" and path == "/dream-machine/v1/generations/camera_motion/list":
+            return "luma_camera_motions", self._luma_camera_motions, ()
+        if method == "POST" and path == "/dream-machine/v1/generations":
+            return "luma_create", self._luma_create, ()
+        if method == "GET" and len(parts) == 4 and parts[:3] == ["dream-machine", "v1", "generations"]:
+            return "luma_get", self._luma_get, (parts[3],)
+        return None
+
+    # Stability AI
+
+    def _stability_image(self, body):
+        artifact = {"base64": base64.b64encode(self.mock.image).decode("ascii"), "seed": 0, "finishReason": "SUCCESS"}
+        self._send(200, {"artifacts": [artifact] * int(body.get("samples", 1))})
+
+    def _stability_start(self, body):
+        self._send(200, {"id": self.mock.new_job()})
+
+    def _stability_result(self, body, job_id):
+        if not self.mock.poll(job_id):
+            return self._send(202, {"id": job_id, "status": "in-progress"})
+        self._send(200, self.mock.video, "video/mp4")
+
+    # OpenAI
+
+    def _openai_images(self, body):
+        data = {"revised_prompt": body.get("prompt", "")}
+        if body.get("response_format") == "b64_json":
+            data["b64_json"] = base64.b64encode(self.mock.image).decode("ascii")
+        else:
+            data["url"] = self._file_url("image.png")
+        self._send(200, {"created": int(time.time()), "data": [data]})
+
+    # Replicate
+
+    def _prediction(self, job_id, model, done, inline=False):
+        if inline:
+            output = "data:image/png;base64," + base64.b64encode(self.mock.image).decode("ascii")
+        else:
+            output = f"{REPLICATE_DELIVERY_URL}/files/image.png"
+        return {
+            "id": job_id,
+            "model": model,
+            "version": "mock",
+            "status": "succeeded" if done else "processing",
+            "input": {},
+            "output": output if done else None,
+            "logs": "",
+            "error": None,
+            "metrics": {},
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "urls": {
+                "get": f"{self.mock.base_url}/v1/predictions/{job_id}",
+                "cancel": f"{self.mock.base_url}/v1/predictions/{job_id}/cancel",
+            },
+        }
+
+    def _replicate_create(self, body, model):
+        job_id = self.mock.new_job()
+        if "wait" not in self.headers.get("Prefer", ""):
+            return self._send(201, dict(self._prediction(job_id, model, False), status="starting"))
+        # "Prefer: wait" holds the request open until the prediction is done and
+        # answers with the output inline, as a data URL
+        while not self.mock.poll(job_id):
+            self._delay()
+            time.sleep(0.01)
+        self._send(201, self._prediction(job_id, model, True, inline=True))
+
+    def _replicate_get(self, body, job_id):
+        if job_id in self.mock.canceled:
+            return self._send(200, dict(self._prediction(job_id, "mock/model", False), status="canceled"))
+        self._send(200, self._prediction(job_id, "mock/model", self.mock.poll(job_id)))
+
+    def _replicate_cancel(self, body, job_id):
+        self.mock.canceled.add(job_id)
+        self._send(200, dict(self._prediction(job_id, "mock/model", False), status="canceled"))
+
+    # RunwayML
+
+    def _runwayml_create(self, body):
+        self._send(200, {"id": self.mock.new_job()})
+
+    def _runwayml_task(self, body, job_id):
+        done = self.mock.poll(job_id)
+        self._send(200, {
+            "id": job_id,
+            "status": "SUCCEEDED" if done else "RUNNING",
+            "createdAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "output": [self._file_url("video.mp4")] if done else None,
+        })
+
+    # Luma
+
+    def _luma_generation(self, job_id, done):
+        return {
+            "id": job_id,
+            "state": "completed" if done else "dreaming",
+            "failure_reason": None,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "assets": {"video": self._file_url("video.mp4")} if done else None,
+            "generation_type": "video",
+            "model": "mock",
+            "request": {},
+        }
+
+    def _luma_camera_motions(self, body):
+        self._send(200, ["camera orbit left", "camera push in", "camera pan right"])
+
+    def _luma_create(self, body):
+        job_id = self.mock.new_job()
+        self._send(201, self._luma_generation(job_id, False))
+
+    def _luma_get(self, body, job_id):
+        self._send(200, self._luma_generation(job_id, self.mock.poll(job_id)))
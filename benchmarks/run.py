@@ -0,0 +1,311 @@
+"""Time Loom's own work against local mock providers and write the results as JSON.
+
+    python -m benchmarks.run --scales 4,16 --repeat 3 --output results.json
+
+Snapshot Mode runs end to end against ``benchmarks.mock_providers``; its
+``overhead_seconds`` is the median time minus the floor the mock latency
+alone imposes, which is the part Loom is responsible for. The media
+benchmarks (frame encoding, segment joining, last-frame extraction and the
+ZIP export) run on generated sample files and need no network at all.
+"""
+
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+from benchmarks.mock_providers import MockProviders, Profile
+
+# Mock endpoints are local, so the real per-host limits would only measure the limiter
+UNLIMITED_RATE_LIMITS = ",".join(
+    f"{host}=10000/10000"
+    for host in ("api.stability.ai", "api.openai.com", "api.replicate.com", "api.dev.runwayml.com", "api.lumalabs.ai")
+)
+
+SNAPSHOT_PROVIDERS = ("Stable Diffusion", "DALL·E", "Flux")
+
+
+def measure(fn, repeat, setup=None):
+    """Run ``fn`` ``repeat`` times and return min/median/mean seconds; ``setup`` runs untimed before each run."""
+    runs = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - started)
+    return {
+        "min": min(runs),
+        "median": statistics.median(runs),
+        "mean": statistics.mean(runs),
+        "runs": runs,
+    }
+
+
+def _quiet(level, message):
+    pass
+
+
+def snapshot_floor(provider, frames, profile):
+    """Shortest possible Snapshot run given only the mock latency and the provider's concurrency."""
+    import engine
+    import providers
+
+    if provider == "Flux":
+        # Every prediction is created up front; the last one then still needs
+        # its status checks (or generation time) and its output download
+        submitters = engine.PredictionFrames.max_submitters
+        created = math.ceil(frames / submitters) * profile.latency
+        running = max((1 + profile.pending_polls) * profile.latency, profile.generation_time)
+        return created + running + profile.asset_latency
+
+    workers = engine.PROVIDER_CONCURRENCY.get(provider, 4)
+    # Stable Diffusion packs several frames into each request
+    if provider == "Stable Diffusion":
+        workers *= min(providers.get_adapter("stability").max_samples, frames)
+    per_frame = profile.latency
+    # DALL·E images are a second request unless they come inline
+    if provider == "DALL·E" and not providers.INLINE_PAYLOADS:
+        per_frame += profile.asset_latency
+    return math.ceil(frames / workers) * per_frame
+
+
+def bench_snapshot(workdir, scales, repeat, profile):
+    import engine
+
+    results = []
+    with MockProviders(profile) as mock:
+        os.environ.setdefault("REPLICATE_API_TOKEN", "mock")
+        for provider in SNAPSHOT_PROVIDERS:
+            for frames in scales:
+                output_path = os.path.join(workdir, "snapshot.mp4")
+
+                def run():
+                    if not engine.run_snapshot(provider, "benchmark", "1:1", frames, 12, output_path,
+                                               "mock", "mock", report=_quiet):
+                        raise RuntimeError(f"Snapshot run with {provider} produced no video")
+
+                requests_before = sum(mock.requests.values())
+                seconds = measure(run, repeat)
+                floor = snapshot_floor(provider, frames, profile)
+                results.append({
+                    "name": "snapshot",
+                    "params": {"provider": provider, "frames": frames},
+                    "seconds": seconds,
+                    "requests_per_run": (sum(mock.requests.values()) - requests_before) / repeat,
+                    "provider_floor_seconds": floor,
+                    "overhead_seconds": seconds["median"] - floor,
+                })
+        results.append({"name": "mock_requests", "params": {}, "counts": dict(mock.requests)})
+    return results
+
+
+def _sample_frames(count, size):
+    return [Image.effect_noise(size, 64).convert("RGB") for _ in range(count)]
+
+
+def bench_encode_frames(workdir, scales, repeat, size):
+    from video import encode_frames
+
+    results = []
+    for frames in scales:
+        images = _sample_frames(frames, size)
+        output_path = os.path.join(workdir, "encoded.mp4")
+        results.append({
+            "name": "encode_frames",
+            "params": {"frames": frames, "size": list(size)},
+            "seconds": measure(lambda: encode_frames(iter(images), 12, output_path), repeat),
+        })
+    return results
+
+
+def _sample_segments(workdir, count, size, seconds=1, fps=25):
+    from video import encode_frames
+
+    paths = []
+    for i in range(count):
+        path = os.path.join(workdir, f"segment_{i}.mp4")
+        frames = (Image.new("RGB", size, ((i * 40 + j * 5) % 256, 96, 160)) for j in range(seconds * fps))
+        paths.append(encode_frames(frames, fps, path, preset="ultrafast"))
+    return paths
+
+
+def bench_join(workdir, scales, repeat, size):
+    import engine
+
+    results = []
+    output_path = os.path.join(workdir, "joined.mp4")
+    for segments in scales:
+        paths = _sample_segments(workdir, segments, size)
+        for crossfade in (0, 0.5):
+            def moviepy_join():
+                final_video, clips = engine.concatenate_videos(paths, crossfade, report=_quiet)
+                try:
+                    final_video.write_videofile(output_path, codec="libx264", audio_codec="aac", logger=None)
+                finally:
+                    final_video.close()
+                    for clip in clips:
+                        clip.close()
+
+            params = {"segments": segments, "crossfade": crossfade, "size": list(size)}
+            results.append({
+                "name": "concatenate_videos",
+                "params": params,
+                "seconds": measure(moviepy_join, repeat),
+            })
+            results.append({
+                "name": "create_longform_video",
+                "params": params,
+                "seconds": measure(
+                    lambda: engine.create_longform_video(paths, output_path, crossfade, report=_quiet), repeat
+                ),
+            })
+    return results
+
+
+def bench_last_frame(workdir, repeat, size):
+    from video import last_frame_png, read_last_frame
+
+    path = _sample_segments(workdir, 1, size, seconds=4)[0]
+    with open(path, "rb") as f:
+        data = f.read()
+    params = {"seconds": 4, "size": list(size)}
+    return [
+        {"name": "read_last_frame", "params": params, "seconds": measure(lambda: read_last_frame(path), repeat)},
+        {"name": "last_frame_png", "params": dict(params, source="path"),
+         "seconds": measure(lambda: last_frame_png(path), repeat)},
+        {"name": "last_frame_png", "params": dict(params, source="bytes"),
+         "seconds": measure(lambda: last_frame_png(data), repeat)},
+    ]
+
+
+def bench_zip_export(workdir, scales, repeat, size):
+    from export import ZipExport
+    from media import MediaStore
+
+    results = []
+    store = MediaStore(root=os.path.join(workdir, "media"))
+    videos = _sample_segments(workdir, 2, size)
+    for images in scales:
+        handles = [store.add_image(image) for image in _sample_frames(images, size)]
+        files = [(f"image_{i+1}.{handle.extension}", handle.path) for i, handle in enumerate(handles)]
+        files += [(os.path.basename(video), video) for video in videos]
+        zip_path = os.path.join(workdir, "export", "generated_content.zip")
+        state = {}
+
+        def fresh():
+            state["export"] = ZipExport(zip_path)
+            if os.path.exists(zip_path):
+                os.remove(zip_path)
+
+        def add_last():
+            # The export already holds everything but the newest video, as after the rerun before it finished
+            fresh()
+            state["export"].update(files[:-1])
+
+        results.append({
+            "name": "zip_export",
+            "params": {"images": images, "videos": len(videos), "mode": "fresh"},
+            "seconds": measure(lambda: state["export"].update(files), repeat, setup=fresh),
+        })
+        results.append({
+            "name": "zip_export",
+            "params": {"images": images, "videos": len(videos), "mode": "incremental"},
+            "seconds": measure(lambda: state["export"].update(files), repeat, setup=add_last),
+        })
+    return results
+
+
+BENCHMARKS = ("snapshot", "encode", "join", "last_frame", "zip")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--benchmarks", default=",".join(BENCHMARKS),
+                        help=f"comma-separated subset of: {', '.join(BENCHMARKS)}")
+    parser.add_argument("--scales", default="4,16", help="comma-separated frame/segment/image counts")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per benchmark")
+    parser.add_argument("--size", default="512x512", help="frame size of the sample media")
+    parser.add_argument("--latency", type=float, default=0.05, help="mock provider answer latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random +- variation of the mock latency")
+    parser.add_argument("--asset-latency", type=float, default=0.0,
+                        help="latency of the mock file host that generated images and videos are downloaded from")
+    parser.add_argument("--generation-time", type=float, default=0.0,
+                        help="seconds a mock job (video, Replicate prediction) takes before it can complete")
+    parser.add_argument("--pending-polls", type=int, default=2, help="status checks a mock job stays pending for")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of mock API requests that fail")
+    parser.add_argument("--error-status", type=int, default=429, help="HTTP status of injected failures")
+    parser.add_argument("--retry-after", type=float, default=0.1, help="Retry-After seconds sent with failures")
+    parser.add_argument("--keep-rate-limits", action="store_true",
+                        help="keep Loom's provider rate limits instead of lifting them for the mocks")
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    args = parser.parse_args(argv)
+
+    if not args.keep_rate_limits:
+        os.environ["LOOM_RATE_LIMITS"] = UNLIMITED_RATE_LIMITS
+    # Keep the benchmark's job store away from the user's
+    workdir = tempfile.mkdtemp(prefix="loom_bench_")
+    os.environ["LOOM_JOB_DIR"] = os.path.join(workdir, "jobs")
+
+    selected = [name.strip() for name in args.benchmarks.split(",") if name.strip()]
+    unknown = set(selected) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+    scales = [int(scale) for scale in args.scales.split(",")]
+    size = tuple(int(part) for part in args.size.split("x"))
+    profile = Profile(
+        latency=args.latency, jitter=args.jitter, asset_latency=args.asset_latency,
+        pending_polls=args.pending_polls, generation_time=args.generation_time,
+        error_rate=args.error_rate, error_status=args.error_status, retry_after=args.retry_after,
+    )
+
+    results = []
+    try:
+        for name in selected:
+            print(f"Running {name} benchmarks...", file=sys.stderr)
+            if name == "snapshot":
+                results += bench_snapshot(workdir, scales, args.repeat, profile)
+            elif name == "encode":
+                results += bench_encode_frames(workdir, scales, args.repeat, size)
+            elif name == "join":
+                results += bench_join(workdir, scales, args.repeat, size)
+            elif name == "last_frame":
+                results += bench_last_frame(workdir, args.repeat, size)
+            elif name == "zip":
+                results += bench_zip_export(workdir, scales, args.repeat, size)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    import providers
+
+    document = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "repeat": args.repeat,
+            "profile": vars(profile),
+            "inline_payloads": providers.INLINE_PAYLOADS,
+        },
+        "results": results,
+    }
+    text = json.dumps(document, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
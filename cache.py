@@ -0,0 +1,164 @@
+"""On-disk, content-addressed cache of generation results.
+
+Results are stored as files named after a SHA-256 key derived from the
+provider, model, normalized prompt, every request parameter and the hash of
+any input image, so identical requests from any Streamlit session on the host
+map to the same entry. Writes go through a temporary file and ``os.replace``
+so concurrent sessions never see partial entries. A hit refreshes the entry's
+modification time and the oldest entries are evicted once the cache grows past
+its size budget. Only use it for deterministic (seeded) requests or where the
+user has explicitly asked to reuse earlier results. Hits and misses are
+counted in ``metrics``.
+
+``TTLCache`` is the in-memory counterpart for provider metadata that only
+needs to be fresh within minutes.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import metrics
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "loom", "generations")
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+
+def normalize_prompt(prompt):
+    return " ".join((prompt or "").split())
+
+
+class GenerationCache:
+    def __init__(self, root=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None
+        os.makedirs(root, exist_ok=True)
+
+    def key(self, provider, model, prompt=None, params=None, input_bytes=None):
+        payload = {
+            "provider": provider,
+            "model": model,
+            "prompt": normalize_prompt(prompt),
+            "params": params or {},
+            "input": hashlib.sha256(input_bytes).hexdigest() if input_bytes is not None else None,
+        }
+        encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            metrics.increment("cache_misses")
+            return None
+        metrics.increment("cache_hits")
+        return data
+
+    def put(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan()[1]
+            else:
+                self._size += len(data)
+            over_budget = self._size > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def _scan(self):
+        entries = []
+        total = 0
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        return entries, total
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in ``max_bytes``."""
+        with self._lock:
+            # Rescan rather than trust the running total: other processes share the directory
+            entries, total = self._scan()
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+            self._size = total
+
+
+class TTLCache:
+    """In-memory values that expire ``ttl`` seconds after they were created, shared by every session.
+
+    Meant for small provider metadata (camera motions, model capabilities)
+    that changes rarely but would otherwise be fetched on every rerun.
+    Failed fetches are not cached.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get_or_create(self, key, create):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[0] > now:
+            metrics.increment("metadata_cache_hits")
+            return entry[1]
+        metrics.increment("metadata_cache_misses")
+        value = create()
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the process-wide cache, configured by ``LOOM_CACHE_DIR`` and ``LOOM_CACHE_MAX_BYTES``."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = GenerationCache(
+                root=os.environ.get("LOOM_CACHE_DIR", DEFAULT_CACHE_DIR),
+                max_bytes=int(os.environ.get("LOOM_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)),
+            )
+    return _cache
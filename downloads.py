@@ -0,0 +1,127 @@
+"""Download manager for generated assets.
+
+Assets are streamed to disk in fixed-size chunks through the shared transport,
+so memory use per download does not depend on the size of the file. Data is
+written to ``<path>.part`` first; if the connection drops, the next attempt
+asks the server for the remaining bytes with an HTTP Range request instead of
+starting over. The finished file is checked against the size the server
+announced (and an optional SHA-256) before it is moved into place. Downloads,
+their bytes and their resumes are recorded in ``metrics``. ``download_async``
+queues a download on a shared pool, so several assets are fetched in parallel
+without holding the caller's thread (e.g. one of the poller's).
+"""
+
+import concurrent.futures
+import hashlib
+import logging
+import os
+import threading
+from urllib.parse import urlsplit
+
+import httpx
+
+import metrics
+import transport
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+MAX_PARALLEL_DOWNLOADS = int(os.environ.get("LOOM_PARALLEL_DOWNLOADS", 4))
+
+
+class DownloadError(Exception):
+    """Raised when a download cannot be completed or fails verification."""
+
+
+def _content_range_total(value):
+    # "bytes 100-199/2000" or "bytes */2000"
+    total = value.rsplit("/", 1)[-1].strip() if value else "*"
+    return int(total) if total.isdigit() else None
+
+
+def _fetch(url, part_path, chunk_size):
+    """Append the missing bytes of ``url`` to ``part_path`` and return the expected total size."""
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    with transport.stream("GET", url, headers=headers) as response:
+        if response.status_code == 416:
+            # Nothing left to fetch: the partial file already holds every byte
+            return _content_range_total(response.headers.get("Content-Range"))
+        response.raise_for_status()
+        if response.status_code == 206:
+            total = _content_range_total(response.headers.get("Content-Range"))
+        else:
+            # The server ignored the Range header and is sending the whole file
+            offset = 0
+            length = response.headers.get("Content-Length")
+            total = int(length) if length and length.isdigit() else None
+        if response.headers.get("Content-Encoding", "identity") != "identity":
+            # Sizes refer to the compressed body, not the bytes written to disk
+            total = None
+        received = 0
+        try:
+            with open(part_path, "ab" if offset else "wb") as f:
+                for chunk in response.iter_bytes(chunk_size):
+                    f.write(chunk)
+                    received += len(chunk)
+        finally:
+            metrics.increment("bytes_received", received, host=urlsplit(url).hostname or "")
+    return total
+
+
+def file_sha256(path, chunk_size=CHUNK_SIZE):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def download(url, path, expected_size=None, sha256=None, retries=3, chunk_size=CHUNK_SIZE):
+    """Stream ``url`` into ``path``, resuming after dropped connections, and return ``path``."""
+    host = urlsplit(url).hostname or ""
+    with metrics.span("download", host=host):
+        return _download(url, path, host, expected_size, sha256, retries, chunk_size)
+
+
+def _download(url, path, host, expected_size, sha256, retries, chunk_size):
+    part_path = f"{path}.part"
+    total = None
+    for attempt in range(retries + 1):
+        try:
+            total = _fetch(url, part_path, chunk_size)
+            break
+        except httpx.TransportError as e:
+            if attempt == retries:
+                raise DownloadError(f"Download of {url} failed after {retries + 1} attempts: {e}") from e
+            metrics.increment("retries", host=host, status="connection")
+            logger.warning("Download of %s interrupted (%s), resuming", url, e)
+
+    size = os.path.getsize(part_path)
+    expected_size = expected_size if expected_size is not None else total
+    if expected_size is not None and size != expected_size:
+        os.remove(part_path)
+        raise DownloadError(f"Download of {url} is {size} bytes, expected {expected_size}")
+    if sha256 is not None and file_sha256(part_path, chunk_size) != sha256.lower():
+        os.remove(part_path)
+        raise DownloadError(f"Checksum mismatch for {url}")
+    os.replace(part_path, path)
+    return path
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def download_async(url, path, **kwargs):
+    """Queue ``download(url, path, **kwargs)`` on the shared pool and return its future.
+
+    Up to ``MAX_PARALLEL_DOWNLOADS`` downloads run at once for the whole process.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=MAX_PARALLEL_DOWNLOADS, thread_name_prefix="download"
+            )
+    return _executor.submit(download, url, path, **kwargs)
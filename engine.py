@@ -0,0 +1,1273 @@
+"""Generation engine shared by the Streamlit UI and the headless batch runner.
+
+Nothing here imports Streamlit. Progress and problems are passed to a
+``report(level, message)`` callable, where ``level`` is one of "info",
+"success", "warning" or "error"; the UI maps these onto ``st.write`` and
+friends, and the batch runner logs them. The default, ``log_report``, logs.
+"""
+
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+import traceback
+import uuid
+
+import httpx
+
+import metrics
+import providers
+from cache import get_cache
+from hedge import DEFAULT_MAX_HEDGE_FRACTION, Hedger, fit_aspect_ratio
+from jobs import BATCH_OWNER_PREFIX
+from media import EncodedImage, MediaStore
+from poller import JobFailed
+from video import (
+    concat_copy, encode_frames, has_reordered_frames, last_frame_png, probe, render_concat, render_segment
+)
+
+logger = logging.getLogger(__name__)
+
+_LOG_LEVELS = {
+    "info": logging.INFO,
+    "success": logging.INFO,
+    "warning": logging.WARNING,
+    "error": logging.ERROR,
+}
+
+
+def log_report(level, message):
+    logger.log(_LOG_LEVELS.get(level, logging.INFO), "%s", message)
+
+
+# Default number of requests in flight per image provider for batch generation.
+PROVIDER_CONCURRENCY = {
+    "DALL·E": 4,
+    "Stable Diffusion": 8,
+    "Flux": 6,
+}
+
+# Flux settings Snapshot Mode generates frames with
+SNAPSHOT_FLUX_SETTINGS = {
+    "output_format": "png",
+    "output_quality": 80,
+    "safety_tolerance": 2,
+    "prompt_upsampling": True,
+}
+
+
+def generate_frames(generate_fn, count, max_workers=4, retries=1, frame_timeout=None, initializer=None):
+    """Run ``generate_fn(index)`` for ``count`` frames with at most ``max_workers`` in flight.
+
+    Yields ``(index, result)`` strictly in frame order while later frames keep
+    generating in the background. A frame that raises or returns None is retried
+    ``retries`` times and then yielded as None; a frame still running
+    ``frame_timeout`` seconds after it becomes next in line is yielded as None
+    too, so one slow or failed frame never stalls the rest of the run.
+    Closing the generator early cancels every frame that has not started yet.
+    ``initializer`` runs once in each worker thread before it takes any frames.
+    """
+    def run(index):
+        for attempt in range(retries + 1):
+            try:
+                result = generate_fn(index)
+            except Exception:
+                logger.exception("Frame %d failed on attempt %d", index + 1, attempt + 1)
+                result = None
+            if result is not None:
+                return result
+        return None
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_workers), initializer=initializer)
+    futures = []
+    try:
+        futures = [executor.submit(run, index) for index in range(count)]
+        for index in range(count):
+            # Dropped once taken so a yielded frame is not kept alive by its future
+            future, futures[index] = futures[index], None
+            try:
+                result = future.result(timeout=frame_timeout)
+            except concurrent.futures.TimeoutError:
+                logger.warning("Frame %d timed out after %s seconds", index + 1, frame_timeout)
+                future.cancel()
+                result = None
+            del future
+            yield index, result
+            del result
+    finally:
+        for future in futures:
+            if future is not None:
+                future.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+class FrameBatcher:
+    """Serve per-frame requests for ``count`` frames from batched generations.
+
+    ``generate_batch(start, size)`` returns up to ``size`` images for the
+    frames from ``start`` on that are not in ``skip`` (frames the caller
+    already has, e.g. cached). Those frames are grouped into batches of
+    ``batch_size``: the first frame of a batch to be asked for makes the
+    request and the others wait for its answer. A frame asked for again (a
+    retry), or skipped, is generated on its own. Callers need a worker per
+    frame of every batch they want in flight, since a batch's frames wait on
+    one request.
+    """
+
+    def __init__(self, generate_batch, count, batch_size, skip=()):
+        self.generate_batch = generate_batch
+        self.count = count
+        self.batch_size = max(1, batch_size)
+        skip = set(skip)
+        self._frames = [index for index in range(count) if index not in skip]
+        self._positions = {index: position for position, index in enumerate(self._frames)}
+        self._batches = {}
+        self._taken = set()
+        self._lock = threading.Lock()
+
+    def __call__(self, index):
+        position = self._positions.get(index)
+        if position is not None:
+            first = position - position % self.batch_size
+            start = self._frames[first]
+            size = min(self.batch_size, len(self._frames) - first)
+        with self._lock:
+            if position is None or index in self._taken:
+                batch = None
+            else:
+                self._taken.add(index)
+                batch = self._batches.get(start)
+                owner = batch is None
+                if owner:
+                    # [future, frames of the batch not yet handed out]
+                    batch = self._batches[start] = [concurrent.futures.Future(), size]
+        if batch is None:
+            images = self.generate_batch(index, 1)
+            return images[0] if images else None
+
+        future = batch[0]
+        if owner:
+            try:
+                future.set_result(self.generate_batch(start, size) or [])
+            except Exception as e:
+                future.set_exception(e)
+        with self._lock:
+            batch[1] -= 1
+            if batch[1] == 0:
+                # Every frame has its image; drop the batch so its images can be freed
+                del self._batches[start]
+        images = future.result()
+        offset = position - first
+        return images[offset] if offset < len(images) else None
+
+    def close(self):
+        with self._lock:
+            self._batches.clear()
+
+
+class PredictionFrames:
+    """Serve per-frame requests for ``count`` frames from predictions submitted up front.
+
+    ``submit(index)`` starts a generation and returns a future for its result
+    (``providers.submit_image_flux``), which ``read``, if given, turns into the
+    frame in the requesting thread. ``start`` submits every frame not in
+    ``skip`` from ``max_submitters`` background threads, in frame order, so the
+    provider works on all of them at once while frames are collected in
+    order. A frame asked for again (a retry), or skipped, gets a prediction of
+    its own. ``close`` cancels every prediction still running.
+    """
+
+    batch_size = 1
+    max_submitters = 4
+
+    def __init__(self, submit, count, skip=(), max_submitters=None, read=None):
+        self.submit = submit
+        self.read = read
+        self.count = count
+        self.skip = set(skip)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_submitters or self.max_submitters, thread_name_prefix="submit"
+        )
+        self._submitted = {}
+        self._jobs = []
+        self._taken = set()
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        for index in range(self.count):
+            if index not in self.skip:
+                self._submitted[index] = self._executor.submit(self._submit, index)
+        return self
+
+    def _submit(self, index):
+        job = self.submit(index)
+        with self._lock:
+            self._jobs.append(job)
+            closed = self._closed
+        if closed:
+            job.cancel()
+        return job
+
+    def __call__(self, index):
+        with self._lock:
+            submitted = None if index in self._taken else self._submitted.pop(index, None)
+            self._taken.add(index)
+        job = submitted.result() if submitted is not None else self._submit(index)
+        result = job.result()
+        return self.read(result) if self.read else result
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            jobs = list(self._jobs)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        for job in jobs:
+            job.cancel()
+
+
+class ChainAssembler:
+    """Assemble a chained longform video in the background while later segments are still generating.
+
+    ``add`` hands a finished segment's bytes to a single ordered worker that
+    writes it to disk and validates it. Without crossfade, and while every
+    segment has the same stream parameters and no B-frames (which keep the
+    stream copy from trimming exactly), nothing is re-encoded: ``finish``
+    joins the segments with a lossless stream copy. Otherwise the worker
+    re-encodes each segment but the newest into a "piece" (last frame trimmed,
+    crossfade head prepended) that matches the final render, so ``finish``
+    only has to stream-copy the pieces together. Pieces are also the fallback
+    when the lossless join fails.
+    """
+
+    def __init__(self, crossfade_duration=0, workdir=".", threads=None):
+        self.crossfade_duration = crossfade_duration
+        self.workdir = workdir
+        self.threads = threads
+        self.segments = []
+        self._pieces = []
+        self._pieces_ok = True
+        self._rendered = 0
+        self._copyable = crossfade_duration == 0
+        self._signature = None
+        self._format = None
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="chain")
+
+    def add(self, index, video_content):
+        """Queue segment ``index``; the returned future resolves to its path or raises if it is invalid."""
+        return self._executor.submit(self._add, index, video_content)
+
+    def _add(self, index, video_content):
+        path = os.path.join(self.workdir, f"video_segment_{index + 1}.mp4")
+        with open(path, "wb") as f:
+            f.write(video_content)
+        try:
+            info = probe(path)
+            if info.duration <= 0:
+                raise ValueError(f"Video segment {path} has no duration")
+        except ValueError:
+            os.remove(path)
+            raise
+        if self._format is None:
+            self._format = (info.width, info.height, info.fps)
+            self._signature = info.stream_signature
+        elif info.stream_signature != self._signature:
+            self._copyable = False
+        if self._copyable:
+            try:
+                self._copyable = not has_reordered_frames(path)
+            except RuntimeError as e:
+                logger.info("Could not inspect %s, rendering the segments: %s", path, e)
+                self._copyable = False
+        self.segments.append(path)
+        if not self._copyable:
+            # Only the newest segment may still become the last one, which keeps its final frame
+            self._render_pieces(len(self.segments) - 1)
+        return path
+
+    def _render_pieces(self, count, last=False):
+        while self._rendered < count:
+            path = self.segments[self._rendered]
+            self._rendered += 1
+            self._render_piece(path, last=last and self._rendered == len(self.segments))
+
+    def _render_piece(self, path, last):
+        if not self._pieces_ok:
+            return
+        width, height, fps = self._format
+        piece_path = f"{os.path.splitext(path)[0]}_piece.mp4"
+        try:
+            render_segment(
+                path, piece_path, width, height, fps,
+                fade_in=self.crossfade_duration if self._pieces else 0,
+                trim_last_frame=not last,
+                threads=self.threads,
+            )
+            self._pieces.append(piece_path)
+        except RuntimeError:
+            logger.exception("Rendering %s in the background failed; the final video will be rendered in one pass", path)
+            self._pieces_ok = False
+
+    def finish(self, output_path):
+        """Wait for queued segments and write the longform video; returns None when there are no segments."""
+        return self._executor.submit(self._finish, output_path).result()
+
+    def _finish(self, output_path):
+        if not self.segments:
+            return None
+        if self._copyable:
+            try:
+                return concat_copy(self.segments, output_path)
+            except RuntimeError as e:
+                logger.info("Lossless join not possible, rendering the segments: %s", e)
+        self._render_pieces(len(self.segments), last=True)
+        if self._pieces_ok:
+            return concat_copy(self._pieces, output_path, trim_last_frame=False)
+        return render_concat(self.segments, output_path, crossfade_duration=self.crossfade_duration, threads=self.threads)
+
+    def close(self):
+        """Stop the worker and delete the intermediate pieces (segments are left to the caller)."""
+        self._executor.shutdown(wait=True)
+        for piece_path in self._pieces:
+            if os.path.exists(piece_path):
+                os.remove(piece_path)
+        self._pieces = []
+
+
+# -----------------------------
+# Image generation
+# -----------------------------
+
+def generate_image_from_text_stability(api_key, prompt, seed=0, report=log_report):
+    try:
+        return providers.generate_image_stability(api_key, prompt, seed)
+    except httpx.HTTPError as e:
+        report("error", f"Error generating image with Stable Diffusion: {str(e)}")
+        return None
+
+
+def generate_images_from_text_stability(api_key, prompt, count, seed=0, report=log_report):
+    """Generate ``count`` Stable Diffusion images for one prompt in as few requests as the API allows."""
+    try:
+        return providers.generate_images_stability(api_key, prompt, count, seed)
+    except httpx.HTTPError as e:
+        report("error", f"Error generating images with Stable Diffusion: {str(e)}")
+        return []
+
+
+def generate_image_from_text_flux(prompt, aspect_ratio, output_format, output_quality, safety_tolerance, prompt_upsampling,
+                                  report=log_report):
+    try:
+        return providers.generate_image_flux(
+            prompt,
+            aspect_ratio=aspect_ratio,
+            output_format=output_format,
+            output_quality=output_quality,
+            safety_tolerance=safety_tolerance,
+            prompt_upsampling=prompt_upsampling
+        )
+    except Exception as e:
+        report("error", f"Error generating image with Flux: {e}")
+        report("error", traceback.format_exc())
+        return None
+
+
+def generate_images_from_text_flux(prompt, count, aspect_ratio, output_format, output_quality, safety_tolerance,
+                                   prompt_upsampling, use_cache=False, report=log_report):
+    """Yield ``count`` Flux images for one prompt in the order they complete.
+
+    Every prediction is submitted before any is waited on, so Replicate works
+    on all of them at once. Closing the generator early cancels the
+    predictions still running. With ``use_cache`` the first image shares its
+    cache entry with a single-image generation of the same settings.
+    """
+    settings = {
+        "aspect_ratio": aspect_ratio,
+        "output_format": output_format,
+        "output_quality": output_quality,
+        "safety_tolerance": safety_tolerance,
+        "prompt_upsampling": prompt_upsampling
+    }
+    cache = get_cache() if use_cache else None
+    cached = []
+    jobs = {}
+    try:
+        for index in range(count):
+            key = None
+            if cache:
+                key = cache.key("replicate", "flux-1.1-pro", prompt, dict(settings, sample=index) if index else settings)
+                data = cache.get(key)
+                if data is not None:
+                    cached.append(EncodedImage.from_bytes(data))
+                    continue
+            try:
+                jobs[providers.submit_image_flux(prompt, **settings)] = key
+            except Exception as e:
+                report("error", f"Error generating image with Flux: {e}")
+        yield from cached
+        for job in concurrent.futures.as_completed(jobs):
+            try:
+                image = providers.read_image_flux(job.result())
+            except Exception as e:
+                report("error", f"Error generating image with Flux: {e}")
+                continue
+            if jobs[job] is not None:
+                cache.put(jobs[job], image.data)
+            yield image
+    finally:
+        for job in jobs:
+            job.cancel()
+
+
+def generate_image_from_text_dalle(api_key, prompt, size, quality, report=log_report):
+    try:
+        image, revised_prompt = providers.generate_image_dalle(api_key, prompt, size, quality)
+        if revised_prompt:
+            report("info", f"**Revised Prompt:** {revised_prompt}")
+        return image
+    except Exception as e:
+        report("error", f"Error generating image with DALL·E: {e}")
+        report("error", traceback.format_exc())
+        return None
+
+
+def cached_image(use_cache, provider, model, prompt, params, generate):
+    """Return ``generate()``'s image, served from the shared generation cache when ``use_cache`` is set."""
+    if not use_cache:
+        return generate()
+    cache = get_cache()
+    key = cache.key(provider, model, prompt, params)
+    data = cache.get(key)
+    if data is not None:
+        return EncodedImage.from_bytes(data)
+    image = generate()
+    if image is not None:
+        cache.put(key, image.data)
+    return image
+
+
+def snapshot_cache_params(aspect_ratio, frame):
+    # The frame number is part of the cache key so a cached run keeps distinct frames
+    return {"aspect_ratio": aspect_ratio, "frame": frame}
+
+
+def generate_snapshot_image(snapshot_generator, prompt, aspect_ratio, stability_api_key, openai_api_key, use_cache=False,
+                            frame=0, report=log_report, batcher=None):
+    """Generate one Snapshot Mode frame.
+
+    With a ``batcher`` (see ``snapshot_batcher``) the frame comes from a
+    batched request or a prediction submitted at the start of the run.
+    """
+    params = snapshot_cache_params(aspect_ratio, frame)
+    if snapshot_generator == "Stable Diffusion":
+        return cached_image(
+            use_cache, "stability", "stable-diffusion-v1-6", prompt, params,
+            lambda: batcher(frame) if batcher else generate_image_from_text_stability(stability_api_key, prompt, report=report)
+        )
+    if snapshot_generator == "Flux":
+        def generate_flux():
+            if batcher is None:
+                return generate_image_from_text_flux(prompt, aspect_ratio=aspect_ratio, report=report,
+                                                     **SNAPSHOT_FLUX_SETTINGS)
+            try:
+                return batcher(frame)
+            except Exception as e:
+                report("error", f"Error generating image with Flux: {e}")
+                return None
+
+        return cached_image(use_cache, "replicate", "flux-1.1-pro", prompt, params, generate_flux)
+    if snapshot_generator == "DALL·E":
+        quality = "standard"  # or "hd"
+        return cached_image(
+            use_cache, "openai", "dall-e-3", prompt, dict(params, quality=quality),
+            lambda: generate_image_from_text_dalle(
+                openai_api_key, prompt, providers.dalle_size_for_aspect_ratio(aspect_ratio), quality, report=report
+            )
+        )
+    report("error", f"🚫 Unsupported generator: {snapshot_generator}")
+    return None
+
+
+def snapshot_batcher(snapshot_generator, prompt, aspect_ratio, num_images, stability_api_key, use_cache=False,
+                     report=log_report):
+    """Return where ``snapshot_generator``'s frames should come from when not requested one by one, or None.
+
+    Stable Diffusion frames not already cached are packed into multi-image
+    requests (``FrameBatcher``). Flux predictions for every frame not already cached are
+    submitted right away (``PredictionFrames``, already started); ``close`` it
+    to cancel the ones still running.
+    """
+    def cached_frames(provider, model):
+        if not use_cache:
+            return []
+        cache = get_cache()
+        return [
+            frame for frame in range(num_images)
+            if cache.get(cache.key(provider, model, prompt, snapshot_cache_params(aspect_ratio, frame))) is not None
+        ]
+
+    if snapshot_generator == "Flux":
+        return PredictionFrames(
+            lambda frame: providers.submit_image_flux(prompt, aspect_ratio=aspect_ratio, **SNAPSHOT_FLUX_SETTINGS),
+            num_images, cached_frames("replicate", "flux-1.1-pro"), read=providers.read_image_flux
+        ).start()
+    if snapshot_generator != "Stable Diffusion":
+        return None
+    # Batches are sized from the frames the cache does not already have
+    skip = cached_frames("stability", "stable-diffusion-v1-6")
+    batch_size = min(providers.get_adapter("stability").max_samples, num_images - len(skip))
+    if batch_size <= 1:
+        return None
+    return FrameBatcher(
+        lambda start, size: generate_images_from_text_stability(stability_api_key, prompt, size, report=report),
+        num_images, batch_size, skip
+    )
+
+
+def generate_snapshot_images(snapshot_generator, prompt, aspect_ratio, num_images, max_workers, stability_api_key,
+                             openai_api_key, use_cache=False, report=log_report, initializer=None, hedger=None,
+                             batcher=None):
+    """Generate Snapshot Mode frames concurrently, yielding ``(index, image)`` in frame order.
+
+    With a ``hedger`` every frame goes through it instead of straight to
+    ``snapshot_generator``; with a ``batcher`` frames share batched requests.
+    """
+    def generate_frame(index):
+        if hedger is not None:
+            return hedger(index)
+        return generate_snapshot_image(
+            snapshot_generator, prompt, aspect_ratio, stability_api_key, openai_api_key, use_cache, index, report,
+            batcher
+        )
+
+    return generate_frames(generate_frame, num_images, max_workers=max_workers, initializer=initializer)
+
+
+def snapshot_hedger(snapshot_generator, hedge_generator, prompt, aspect_ratio, stability_api_key, openai_api_key,
+                    use_cache=False, max_hedge_fraction=DEFAULT_MAX_HEDGE_FRACTION, max_workers=4, report=log_report,
+                    initializer=None, batcher=None):
+    """Build a ``Hedger`` racing ``hedge_generator`` against slow ``snapshot_generator`` frames.
+
+    Both providers' frames are cropped to ``aspect_ratio`` so a hedged frame
+    fits the video. A ``batcher`` serves the primary's frames.
+    """
+    def frame_fn(generator, batcher=None):
+        def generate(index):
+            image = generate_snapshot_image(
+                generator, prompt, aspect_ratio, stability_api_key, openai_api_key, use_cache, index, report, batcher
+            )
+            return fit_aspect_ratio(image, aspect_ratio) if image is not None else None
+        return generate
+
+    return Hedger(
+        snapshot_generator, hedge_generator, frame_fn(snapshot_generator, batcher), frame_fn(hedge_generator),
+        max_hedge_fraction=max_hedge_fraction, max_workers=2 * max_workers, initializer=initializer
+    )
+
+
+def run_snapshot(snapshot_generator, prompt, aspect_ratio, num_images, fps, output_path, stability_api_key,
+                 openai_api_key, max_workers=None, use_cache=False, report=log_report, on_image=None,
+                 on_progress=None, initializer=None, hedge_generator=None,
+                 max_hedge_fraction=DEFAULT_MAX_HEDGE_FRACTION):
+    """Generate Snapshot Mode frames and encode them into ``output_path`` as they arrive.
+
+    ``on_image(image)`` sees every generated frame and ``on_progress(done, total)``
+    is called after each one. With a ``hedge_generator``, frames slower than
+    the primary's p95 latency are also requested from it, for at most
+    ``max_hedge_fraction`` of the frames. Providers that can return several
+    images per request get their frames in batches, and ``max_workers`` then
+    counts requests rather than frames. Flux predictions for every frame are
+    submitted up front and cancelled if the run ends early. Returns the video
+    path, or None when no frame was generated.
+    """
+    if max_workers is None:
+        max_workers = PROVIDER_CONCURRENCY.get(snapshot_generator, 4)
+    batcher = snapshot_batcher(snapshot_generator, prompt, aspect_ratio, num_images, stability_api_key, use_cache, report)
+    if batcher is not None:
+        # Every frame of a batch holds a worker while it waits for the batch's request
+        max_workers *= batcher.batch_size
+    hedger = None
+    if hedge_generator and hedge_generator != snapshot_generator:
+        hedger = snapshot_hedger(
+            snapshot_generator, hedge_generator, prompt, aspect_ratio, stability_api_key, openai_api_key,
+            use_cache, max_hedge_fraction, max_workers, report, initializer, batcher
+        )
+
+    def frames():
+        # Frames are handed to the encoder as soon as they arrive in order
+        for i, image in generate_snapshot_images(
+            snapshot_generator, prompt, aspect_ratio, num_images, max_workers,
+            stability_api_key, openai_api_key, use_cache, report, initializer, hedger, batcher
+        ):
+            if on_progress:
+                on_progress(i + 1, num_images)
+            if image:
+                if on_image:
+                    on_image(image)
+                yield image
+            else:
+                report("error", f"❌ Failed to generate image {i+1}")
+
+    try:
+        return encode_frames(frames(), fps, output_path)
+    finally:
+        if batcher is not None:
+            # Cancels predictions still running when the run is aborted
+            batcher.close()
+        if hedger is not None:
+            hedger.close()
+            report("info", f"⚡ Hedged {hedger.hedges} of {hedger.requests} requests with {hedge_generator}; "
+                           f"the backup was faster {hedger.backup_wins} time(s)")
+
+
+def generate_image_hedged(primary, primary_fn, backup, backup_fn, aspect_ratio, max_hedge_fraction=1.0,
+                          initializer=None):
+    """Generate one image with ``primary_fn()``, hedged by ``backup_fn()``; the result is cropped to ``aspect_ratio``."""
+    def fit(generate):
+        def generate_fitted():
+            image = generate()
+            return fit_aspect_ratio(image, aspect_ratio) if image is not None else None
+        return generate_fitted
+
+    hedger = Hedger(
+        primary, backup, fit(primary_fn), fit(backup_fn),
+        max_hedge_fraction=max_hedge_fraction, max_workers=2, initializer=initializer
+    )
+    try:
+        return hedger()
+    finally:
+        hedger.close()
+
+
+# -----------------------------
+# Stability video
+# -----------------------------
+
+def start_video_generation_stability(api_key, image, cfg_scale=1.8, motion_bucket_id=127, seed=0, report=log_report):
+    try:
+        return providers.start_video_stability(api_key, image, cfg_scale, motion_bucket_id, seed)
+    except (httpx.HTTPError, providers.ProviderError) as e:
+        report("error", f"Error starting video generation with Stability AI: {str(e)}")
+        return None
+
+
+def poll_for_video_stability(api_key, generation_id, report=log_report):
+    report("info", f"⌛ Video generation in progress... Waiting for Stability AI generation {generation_id}")
+    try:
+        return providers.wait_for_video_stability(api_key, generation_id, timeout=600)
+    except TimeoutError:
+        report("error", "Video generation timed out with Stability AI. Please try again.")
+        return None
+    except httpx.HTTPError as e:
+        report("error", f"Error polling for video with Stability AI: {str(e)}")
+        return None
+
+
+def read_tracked_video(job, future, report=log_report):
+    """Wait for a job store future and return the video bytes, or None after reporting why not."""
+    try:
+        with open(future.result(), "rb") as f:
+            return f.read()
+    except TimeoutError:
+        report("error", f"Video generation {job.generation_id} is still running; it will be picked up again on the next run.")
+    except JobFailed as e:
+        report("error", f"❌ Generation {job.generation_id} failed: {e}")
+    except Exception as e:
+        report("error", f"Error waiting for generation {job.generation_id}: {str(e)}")
+    return None
+
+
+def stability_tracker(job_store, api_key, owner, **job_fields):
+    """Build a ``track`` callable for ``generate_video_stability`` that records generations in ``job_store``."""
+    def track(generation_id):
+        job = job_store.add("stability", generation_id, owner, **job_fields)
+        return job, job_store.watch(job, api_key, timeout=600)
+    return track
+
+
+def generate_video_stability(api_key, image, cfg_scale=1.8, motion_bucket_id=127, seed=0, use_cache=False,
+                             report=log_report, track=None):
+    """Start a Stability image-to-video job and wait for it.
+
+    Seeded requests are deterministic, so with ``use_cache`` they are served from
+    the shared generation cache when the same image and settings were used before.
+    ``track(generation_id)``, if given, records the new generation and returns
+    ``(job, future)`` from the job store, which then does the waiting.
+    """
+    def generate():
+        generation_id = start_video_generation_stability(api_key, image, cfg_scale, motion_bucket_id, seed, report)
+        if not generation_id:
+            return None
+        if track is None:
+            return poll_for_video_stability(api_key, generation_id, report)
+        report("info", f"⌛ Video generation in progress... Waiting for Stability AI generation {generation_id}")
+        return read_tracked_video(*track(generation_id), report=report)
+
+    if not (use_cache and seed):
+        return generate()
+    cache = get_cache()
+    key = cache.key(
+        "stability", "image-to-video",
+        params={"cfg_scale": cfg_scale, "motion_bucket_id": motion_bucket_id, "seed": seed},
+        input_bytes=providers.image_upload_bytes(image)
+    )
+    video_content = cache.get(key)
+    if video_content is not None:
+        report("info", "♻️ Reusing cached Stability AI video for identical settings.")
+        return video_content
+    video_content = generate()
+    if video_content:
+        cache.put(key, video_content)
+    return video_content
+
+
+def get_last_frame_bytes(video, report=log_report):
+    """Return ``(png_bytes, width, height)`` for the last frame of a video path or in-memory video content."""
+    try:
+        last_frame = last_frame_png(video)
+        if last_frame is None:
+            report("error", "Could not decode the last frame of the video segment")
+        return last_frame
+    except Exception as e:
+        report("error", f"Error extracting last frame: {str(e)}")
+        return None
+
+
+def run_text_to_video(api_key, prompt, output_path, num_segments=5, cfg_scale=1.8, motion_bucket_id=127, seed=0,
+                      crossfade_duration=0, use_cache=False, workdir=".", report=log_report, on_image=None,
+                      on_segment=None, job_store=None, owner=""):
+    """Chain Stability image-to-video segments from a text prompt into one longform video.
+
+    Each segment starts from the previous segment's last frame. ``on_image``
+    sees the initial image and every handed-over frame, ``on_segment(path)``
+    every segment that was saved. Segments are removed once the longform video
+    exists. Returns its path, or None.
+
+    With a ``job_store`` every segment generation is recorded under ``owner``,
+    and running the same prompt and settings again after an interruption
+    reuses the segments that were already generated (or are still running)
+    and continues from the last one.
+    """
+    chain = None
+    recorded = {}
+    if job_store is not None:
+        chain = job_store.start_chain(owner, prompt, {
+            "num_segments": num_segments, "cfg_scale": cfg_scale, "motion_bucket_id": motion_bucket_id,
+            "seed": seed, "crossfade_duration": crossfade_duration,
+        })
+        recorded = job_store.chain_segments(chain.id)
+        if recorded:
+            report("info", f"♻️ Resuming an earlier run: {len(recorded)} of {num_segments} segments already started")
+
+    current_image = None
+    if 0 not in recorded:
+        report("success", "🔄 Generating initial image from text prompt...")
+        image = cached_image(
+            use_cache and seed, "stability", "stable-diffusion-v1-6", prompt, {"seed": seed},
+            lambda: generate_image_from_text_stability(api_key, prompt, seed, report)
+        )
+        if image is None:
+            report("error", "❌ Failed to generate the initial image.")
+            return None
+        image = image.resized((768, 768))
+        if on_image:
+            on_image(image)
+        current_image = image
+
+    # Writing, validating and assembling segments overlaps the next remote generation
+    assembler = ChainAssembler(crossfade_duration=crossfade_duration, workdir=workdir)
+    segment_jobs = []
+
+    for i in range(num_segments):
+        report("info", f"🎞️ Generating video segment {i+1}/{num_segments}...")
+        if i in recorded:
+            job = recorded[i]
+            report("info", f"♻️ Reattaching to Stability AI generation {job.generation_id}")
+            video_content = read_tracked_video(job, job_store.watch(job, api_key, timeout=600), report)
+        elif current_image is None:
+            report("error", f"❌ Cannot generate video segment {i+1} without the previous segment's last frame.")
+            break
+        else:
+            track = stability_tracker(job_store, api_key, owner, chain_id=chain.id, segment=i) if chain else None
+            video_content = generate_video_stability(
+                api_key, current_image, cfg_scale, motion_bucket_id, seed, use_cache, report, track
+            )
+
+        if video_content:
+            segment_jobs.append((i, assembler.add(i, video_content)))
+
+            # Taken from the in-memory response and handed on as ready-to-upload PNG bytes, never decoded
+            last_frame = get_last_frame_bytes(video_content, report)
+            if last_frame:
+                png, width, height = last_frame
+                current_image = EncodedImage(png, "PNG", width, height)
+                if on_image:
+                    on_image(current_image)
+            else:
+                report("warning", f"⚠️ Could not extract last frame from segment {i+1}. Using previous image.")
+        else:
+            report("error", f"❌ Failed to generate video segment {i+1}.")
+
+    video_clips = []
+    for i, job in segment_jobs:
+        try:
+            video_path = job.result()
+        except Exception as e:
+            report("warning", f"⚠️ Skipping invalid video segment {i+1}: {str(e)}")
+            continue
+        report("info", f"✅ Saved video segment to {video_path}")
+        video_clips.append(video_path)
+        if on_segment:
+            on_segment(video_path)
+
+    if not video_clips:
+        assembler.close()
+        report("error", "❌ No video segments were successfully generated.")
+        return None
+
+    report("success", "🔗 Finishing longform video from the assembled segments...")
+    try:
+        final_video_path = assembler.finish(output_path)
+    except Exception as e:
+        report("info", f"Incremental assembly failed, concatenating from scratch: {str(e)}")
+        final_video_path = create_longform_video(video_clips, output_path, crossfade_duration, report)
+    finally:
+        assembler.close()
+    if not final_video_path:
+        report("error", "❌ Failed to create the final video.")
+        return None
+
+    report("success", f"🎬 Longform video created: {final_video_path}")
+    if chain is not None and len(video_clips) == num_segments:
+        job_store.finish_chain(chain.id, os.path.abspath(final_video_path))
+    # Clean up individual video segments
+    for video_file in video_clips:
+        if os.path.exists(video_file):
+            os.remove(video_file)
+            report("info", f"🗑️ Removed temporary file: {video_file}")
+        else:
+            report("warning", f"⚠️ Could not find file to remove: {video_file}")
+    return final_video_path
+
+
+def run_image_to_video(api_key, image, output_path, cfg_scale=1.8, motion_bucket_id=127, seed=0, use_cache=False,
+                       report=log_report, on_image=None, job_store=None, owner=""):
+    """Animate one image (``EncodedImage``, PIL image, path or file object) with Stability AI into ``output_path``; returns the path or None.
+
+    With a ``job_store`` the generation is recorded under ``owner`` and downloaded straight to ``output_path``.
+    """
+    image = EncodedImage.open(image).resized((768, 768))
+    if on_image:
+        on_image(image)
+
+    track = stability_tracker(job_store, api_key, owner, artifact=output_path) if job_store else None
+    report("success", "🔄 Starting video generation from uploaded image...")
+    video_content = generate_video_stability(api_key, image, cfg_scale, motion_bucket_id, seed, use_cache, report, track)
+    if not video_content:
+        report("error", "❌ Failed to generate video.")
+        return None
+    with open(output_path, "wb") as f:
+        f.write(video_content)
+    report("success", f"✅ Image-to-Video created: {output_path}")
+    return output_path
+
+
+# -----------------------------
+# Joining videos
+# -----------------------------
+
+def validate_video_clip(video_path, report=log_report):
+    if not os.path.exists(video_path):
+        report("error", f"Video file not found: {video_path}")
+        return False
+    try:
+        duration = probe(video_path).duration
+        report("info", f"Validated video clip: {video_path}, Duration: {duration} seconds")
+        return duration > 0
+    except Exception as e:
+        report("error", f"Invalid video segment: {video_path}, Error: {str(e)}")
+        return False
+
+
+def concatenate_videos(video_clips, crossfade_duration=0, report=log_report):
+    # MoviePy is only the fallback joiner, so it is not loaded until a join needs it
+    from moviepy.editor import VideoFileClip, concatenate_videoclips, CompositeVideoClip, vfx
+
+    valid_clips = []
+    for clip_path in video_clips:
+        report("info", f"Attempting to load clip: {clip_path}")
+        if validate_video_clip(clip_path, report):
+            try:
+                clip = VideoFileClip(clip_path)
+                if clip is not None and clip.duration > 0:
+                    valid_clips.append(clip)
+                    report("info", f"Successfully loaded clip: {clip_path}, Duration: {clip.duration} seconds")
+                else:
+                    report("warning", f"Skipping invalid clip: {clip_path}")
+            except Exception as e:
+                report("warning", f"Error loading clip {clip_path}: {str(e)}")
+        else:
+            report("warning", f"Validation failed for clip: {clip_path}")
+
+    if not valid_clips:
+        report("error", "No valid video segments found. Unable to concatenate.")
+        return None, None
+
+    try:
+        report("info", f"Attempting to concatenate {len(valid_clips)} valid clips")
+
+        # Trim the last frame from all clips except the last one
+        trimmed_clips = []
+        for i, clip in enumerate(valid_clips):
+            if i < len(valid_clips) - 1:
+                # Subtract exactly one frame at the clip's probed frame rate
+                trimmed_clip = clip.subclip(0, clip.duration - 1/probe(clip.filename).fps)
+                trimmed_clips.append(trimmed_clip)
+            else:
+                trimmed_clips.append(clip)
+
+        if crossfade_duration > 0:
+            report("info", f"Applying crossfade of {crossfade_duration} seconds")
+            # Apply crossfade transition
+            final_clips = []
+            for i, clip in enumerate(trimmed_clips):
+                if i == 0:
+                    final_clips.append(clip)
+                else:
+                    # Create a crossfade transition
+                    fade_out = trimmed_clips[i-1].fx(vfx.fadeout, duration=crossfade_duration)
+                    fade_in = clip.fx(vfx.fadein, duration=crossfade_duration)
+                    transition = CompositeVideoClip([fade_out, fade_in])
+                    transition = transition.set_duration(crossfade_duration)
+
+                    # Add the transition and the full clip
+                    final_clips.append(transition)
+                    final_clips.append(clip)
+
+            final_video = concatenate_videoclips(final_clips)
+        else:
+            final_video = concatenate_videoclips(trimmed_clips)
+
+        report("info", f"Concatenation successful. Final video duration: {final_video.duration} seconds")
+        return final_video, valid_clips
+    except Exception as e:
+        report("error", f"Error concatenating videos: {str(e)}")
+        for clip in valid_clips:
+            clip.close()
+        return None, None
+
+
+def create_longform_video(video_clips, output_path, crossfade_duration=0, report=log_report):
+    """Join segments into ``output_path``.
+
+    Identical segments without crossfade are stream-copied; otherwise the whole
+    list is rendered by one ffmpeg filter graph, with MoviePy as the fallback.
+    """
+    valid_paths = [clip_path for clip_path in video_clips if validate_video_clip(clip_path, report)]
+    if not valid_paths:
+        report("error", "No valid video segments found. Unable to concatenate.")
+        return None
+
+    infos = [probe(clip_path) for clip_path in valid_paths]
+    if crossfade_duration == 0 and len({info.stream_signature for info in infos}) == 1:
+        try:
+            concat_copy(valid_paths, output_path)
+            report("info", f"⚡ Joined {len(valid_paths)} segments without re-encoding")
+            return output_path
+        except RuntimeError as e:
+            report("info", f"Stream copy not possible, re-encoding instead: {e}")
+
+    # The filter graph renders video only, so clips with audio go through MoviePy
+    if not any(info.has_audio for info in infos):
+        try:
+            render_concat(valid_paths, output_path, crossfade_duration=crossfade_duration)
+            report("info", f"⚡ Rendered {len(valid_paths)} segments in a single ffmpeg pass")
+            return output_path
+        except RuntimeError as e:
+            report("info", f"Native render failed, falling back to MoviePy: {e}")
+
+    with metrics.span("concat", method="moviepy"):
+        final_video, valid_clips = concatenate_videos(valid_paths, crossfade_duration, report)
+    if not final_video:
+        return None
+    try:
+        with metrics.span("encode", method="moviepy"):
+            final_video.write_videofile(output_path, codec="libx264", audio_codec="aac")
+        return output_path
+    except Exception as e:
+        report("error", f"❌ Error writing final video: {str(e)}")
+        report("info", f"📜 Traceback: {traceback.format_exc()}")
+        return None
+    finally:
+        final_video.close()
+        for clip in valid_clips:
+            clip.close()
+
+
+# -----------------------------
+# RunwayML and Luma
+# -----------------------------
+
+def generate_video_runwayml(runway_api_key, prompt_image_url, prompt_text, output_path=None, report=log_report,
+                            job_store=None, owner=""):
+    """Generate and download a RunwayML video; returns its path, or None after reporting the failure.
+
+    With a ``job_store`` the generation is recorded under ``owner`` and watched
+    through the store; when ``owner`` has a pending generation for
+    ``output_path`` with the same image and prompt, it is reattached to instead.
+    """
+    runwayml = providers.sdk("runwayml")
+
+    def started(generation_id):
+        report("info", f"RunwayML Video Generation ID: {generation_id}")
+        report("info", "⌛ RunwayML Video Generation in progress... Waiting for completion.")
+
+    try:
+        if job_store is None:
+            video_path = providers.generate_video_runwayml(
+                runway_api_key, prompt_image_url, prompt_text, output_path, on_started=started
+            )
+        else:
+            params = {"prompt_image": prompt_image_url, "prompt_text": prompt_text}
+            job = job_store.reusable("runwayml", owner, output_path, params) if output_path else None
+            if job is not None:
+                report("info", f"♻️ Reattaching to RunwayML generation {job.generation_id}")
+            else:
+                generation_id = providers.start_video_runwayml(runway_api_key, prompt_image_url, prompt_text)
+                started(generation_id)
+                job = job_store.add("runwayml", generation_id, owner, artifact=output_path, params=params)
+            video_path = job_store.watch(job, runway_api_key).result()
+    except JobFailed as e:
+        report("error", f"RunwayML Video Generation Failed: {e}")
+        return None
+    except runwayml.APIConnectionError as e:
+        report("error", "RunwayML API Connection Error.")
+        report("error", str(e.__cause__))  # an underlying Exception, likely raised within httpx.
+        return None
+    except runwayml.RateLimitError:
+        report("error", "RunwayML Rate Limit Exceeded. Please wait and try again.")
+        return None
+    except runwayml.APIStatusError as e:
+        report("error", f"RunwayML API returned an error: {e.status_code}")
+        report("error", str(e.response))
+        return None
+    except Exception as e:
+        report("error", f"An unexpected error occurred with RunwayML: {e}")
+        report("error", traceback.format_exc())
+        return None
+    report("success", "RunwayML Video Generation Completed.")
+    report("info", f"✅ Saved RunwayML video to {video_path}")
+    return video_path
+
+
+def luma_generation_params(prompt, aspect_ratio="16:9", loop=False, camera_motion=None, keyframes=None):
+    generation_params = {
+        "prompt": f"{prompt}, {camera_motion}" if camera_motion else prompt,
+        "aspect_ratio": aspect_ratio,
+        "loop": loop,
+    }
+    if keyframes:
+        generation_params["keyframes"] = keyframes
+    return generation_params
+
+
+def generate_video_luma(luma_api_key, generation_params, output_path=None, report=log_report, job_store=None, owner=""):
+    """Generate and download a Luma video; returns its path, or None when the generation failed.
+
+    With a ``job_store`` the generation is recorded under ``owner`` and watched
+    through the store; when ``owner`` has a pending generation for
+    ``output_path`` with the same ``generation_params``, it is reattached to instead.
+    """
+    def started(generation_id):
+        report("info", "⌛ Video generation in progress... Waiting for completion.")
+
+    try:
+        if job_store is None:
+            video_path = providers.generate_video_luma(luma_api_key, generation_params, output_path, on_started=started)
+        else:
+            job = job_store.reusable("luma", owner, output_path, generation_params) if output_path else None
+            if job is not None:
+                report("info", f"♻️ Reattaching to Luma generation {job.generation_id}")
+            else:
+                generation_id = providers.start_video_luma(luma_api_key, generation_params)
+                started(generation_id)
+                job = job_store.add("luma", generation_id, owner, artifact=output_path, params=generation_params)
+            video_path = job_store.watch(job, luma_api_key).result()
+    except JobFailed as e:
+        report("error", f"❌ Generation failed: {e}")
+        return None
+    report("success", f"✅ Video generated and saved to {video_path}")
+    return video_path
+
+
+# -----------------------------
+# Batch jobs
+# -----------------------------
+
+# Job "provider" values accepted for image generation, mapped to the UI's generator names
+IMAGE_PROVIDERS = {
+    "dall·e": "DALL·E",
+    "dalle": "DALL·E",
+    "openai": "DALL·E",
+    "stable diffusion": "Stable Diffusion",
+    "stability": "Stable Diffusion",
+    "flux": "Flux",
+    "replicate": "Flux",
+}
+
+JOB_MODES = ("snapshot", "image", "text-to-video", "image-to-video", "runwayml", "luma")
+
+# API key each generator or mode needs, by its name in the ``api_keys`` mapping
+REQUIRED_KEYS = {
+    "DALL·E": "openai",
+    "Stable Diffusion": "stability",
+    "Flux": "replicate",
+    "text-to-video": "stability",
+    "image-to-video": "stability",
+    "runwayml": "runwayml",
+    "luma": "luma",
+}
+
+
+def generate_image(generator, prompt, params, api_keys, report=log_report):
+    """Generate one image with ``generator`` ("DALL·E", "Stable Diffusion" or "Flux") from job-style ``params``."""
+    aspect_ratio = params.get("aspect_ratio", "1:1")
+    if generator == "Stable Diffusion":
+        return generate_image_from_text_stability(api_keys.get("stability"), prompt, params.get("seed", 0), report)
+    if generator == "Flux":
+        return generate_image_from_text_flux(
+            prompt,
+            aspect_ratio=aspect_ratio,
+            output_format=params.get("output_format", "png"),
+            output_quality=params.get("output_quality", 80),
+            safety_tolerance=params.get("safety_tolerance", 2),
+            prompt_upsampling=params.get("prompt_upsampling", True),
+            report=report
+        )
+    return generate_image_from_text_dalle(
+        api_keys.get("openai"), prompt, providers.dalle_size_for_aspect_ratio(aspect_ratio),
+        params.get("quality", "standard"), report
+    )
+
+
+def run_job(job, output_dir, api_keys, report=log_report, job_store=None):
+    """Run one batch job and return its manifest record.
+
+    ``job`` is a mapping with ``id``, ``mode`` (one of ``JOB_MODES``),
+    ``provider`` (image generator for "snapshot" and "image" jobs), ``prompt``
+    and ``params``. ``api_keys`` maps "stability", "openai", "replicate",
+    "runwayml" and "luma" to keys. Outputs go to ``output_dir/<id>/``. Failures
+    never raise; they end up in the record's ``status`` and ``errors``. With a
+    ``job_store``, video generations are recorded under "batch:<id>", so
+    running an interrupted Text-to-Video job again continues its chain and a
+    RunwayML or Luma job reattaches to its earlier generation.
+    """
+    job_id = str(job.get("id") or uuid.uuid4().hex[:12])
+    mode = job.get("mode", "")
+    prompt = job.get("prompt", "")
+    params = job.get("params") or {}
+    generator = IMAGE_PROVIDERS.get(str(job.get("provider", "")).lower())
+    job_dir = os.path.join(output_dir, job_id)
+    os.makedirs(job_dir, exist_ok=True)
+    tracking = {"job_store": job_store, "owner": f"{BATCH_OWNER_PREFIX}{job_id}"}
+
+    errors = []
+    outputs = []
+    store = MediaStore(root=os.path.join(job_dir, "images"))
+
+    def job_report(level, message):
+        if level == "error":
+            errors.append(message)
+        report(level, f"[{job_id}] {message}")
+
+    def on_image(image):
+        outputs.append(store.add_image(image).path)
+
+    started = time.monotonic()
+    video_path = None
+    try:
+        if mode not in JOB_MODES:
+            raise ValueError(f"Unknown mode {mode!r}; expected one of {', '.join(JOB_MODES)}")
+        if mode in ("snapshot", "image") and generator is None:
+            raise ValueError(f"Unknown image provider {job.get('provider')!r}")
+        key_name = REQUIRED_KEYS[generator if mode in ("snapshot", "image") else mode]
+        if not api_keys.get(key_name):
+            raise ValueError(f"Missing {key_name} API key")
+        if mode in ("snapshot", "image", "text-to-video", "luma") and not prompt:
+            raise ValueError("Job has no prompt")
+
+        if mode == "snapshot":
+            video_path = run_snapshot(
+                generator, prompt, params.get("aspect_ratio", "1:1"), params.get("num_images", 10),
+                params.get("fps", 24), os.path.join(job_dir, "snapshot_mode_video.mp4"),
+                api_keys.get("stability"), api_keys.get("openai"),
+                max_workers=params.get("max_workers"), use_cache=params.get("use_cache", False),
+                report=job_report, on_image=on_image,
+                hedge_generator=IMAGE_PROVIDERS.get(str(params.get("hedge_provider", "")).lower()),
+                max_hedge_fraction=params.get("max_hedge_fraction", DEFAULT_MAX_HEDGE_FRACTION)
+            )
+        elif mode == "image":
+            image = cached_image(
+                params.get("use_cache", False), "batch", generator, prompt,
+                {name: value for name, value in params.items() if name != "use_cache"},
+                lambda: generate_image(generator, prompt, params, api_keys, job_report)
+            )
+            if image is not None:
+                on_image(image)
+        elif mode == "text-to-video":
+            video_path = run_text_to_video(
+                api_keys["stability"], prompt, os.path.join(job_dir, "longform_video.mp4"),
+                num_segments=params.get("num_segments", 5), cfg_scale=params.get("cfg_scale", 1.8),
+                motion_bucket_id=params.get("motion_bucket_id", 127), seed=params.get("seed", 0),
+                crossfade_duration=params.get("crossfade_duration", 0), use_cache=params.get("use_cache", False),
+                workdir=job_dir, report=job_report, on_image=on_image, **tracking
+            )
+        elif mode == "image-to-video":
+            if not params.get("image"):
+                raise ValueError("image-to-video jobs need params.image")
+            video_path = run_image_to_video(
+                api_keys["stability"], params["image"], os.path.join(job_dir, "image_to_video.mp4"),
+                cfg_scale=params.get("cfg_scale", 1.8), motion_bucket_id=params.get("motion_bucket_id", 127),
+                seed=params.get("seed", 0), use_cache=params.get("use_cache", False),
+                report=job_report, on_image=on_image, **tracking
+            )
+        elif mode == "runwayml":
+            if not params.get("prompt_image_url"):
+                raise ValueError("runwayml jobs need params.prompt_image_url")
+            video_path = generate_video_runwayml(
+                api_keys["runwayml"], params["prompt_image_url"], prompt,
+                os.path.join(job_dir, "runwayml_video.mp4"), job_report, **tracking
+            )
+        elif mode == "luma":
+            generation_params = luma_generation_params(
+                prompt, params.get("aspect_ratio", "16:9"), params.get("loop", False),
+                params.get("camera_motion"), params.get("keyframes")
+            )
+            video_path = generate_video_luma(
+                api_keys["luma"], generation_params, os.path.join(job_dir, "luma_video.mp4"), job_report, **tracking
+            )
+    except Exception as e:
+        job_report("error", f"{type(e).__name__}: {e}")
+        logger.debug("Job %s failed", job_id, exc_info=True)
+
+    if video_path:
+        outputs.append(video_path)
+    produced = video_path if mode != "image" else outputs
+    return {
+        "id": job_id,
+        "mode": mode,
+        "provider": job.get("provider"),
+        "status": "succeeded" if produced else "failed",
+        "outputs": outputs,
+        "errors": errors,
+        "seconds": round(time.monotonic() - started, 3),
+    }
+
+
+def run_batch(jobs, output_dir, api_keys, concurrency=2, report=log_report, job_store=None):
+    """Run ``jobs`` with at most ``concurrency`` at a time, yielding manifest records as jobs finish."""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="job") as executor:
+        futures = [executor.submit(run_job, job, output_dir, api_keys, report, job_store) for job in jobs]
+        for future in concurrent.futures.as_completed(futures):
+            yield future.result()
@@ -0,0 +1,58 @@
+"""Incremental ZIP export of a session's generated media.
+
+The archive lives on disk and is only touched when the session's content
+changes: new files are appended to the existing archive, and a full rewrite
+happens only when an entry already in it was modified or removed. Media that
+is already compressed (video, PNG/JPEG/WebP) is stored as-is instead of being
+deflated a second time.
+"""
+
+import os
+import zipfile
+
+import metrics
+
+STORED_EXTENSIONS = {".mp4", ".mov", ".webm", ".png", ".jpg", ".jpeg", ".webp", ".gif", ".zip"}
+
+
+def compress_type_for(path):
+    if os.path.splitext(path)[1].lower() in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+class ZipExport:
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}
+
+    @staticmethod
+    def _signature(path):
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def update(self, files):
+        """Bring the archive in line with ``files``, a list of ``(arcname, source_path)``, and return its path."""
+        wanted = {arcname: (source, self._signature(source)) for arcname, source in files}
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        os.utime(directory)  # in use, so media.remove_stale_dirs keeps it
+        exists = os.path.exists(self.path)
+        if exists and wanted == self._entries:
+            return self.path
+
+        # Entries are matched by name, so new files are appended wherever they sit in ``files``
+        unchanged = all(wanted.get(arcname) == entry for arcname, entry in self._entries.items())
+        if exists and unchanged:
+            with metrics.span("zip", mode="append"), zipfile.ZipFile(self.path, "a") as zipf:
+                for arcname, (source, _) in wanted.items():
+                    if arcname not in self._entries:
+                        zipf.write(source, arcname, compress_type=compress_type_for(source))
+        else:
+            tmp_path = f"{self.path}.tmp"
+            with metrics.span("zip", mode="rewrite"), zipfile.ZipFile(tmp_path, "w") as zipf:
+                for arcname, (source, _) in wanted.items():
+                    zipf.write(source, arcname, compress_type=compress_type_for(source))
+            os.replace(tmp_path, self.path)
+        self._entries = wanted
+        return self.path
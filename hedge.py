@@ -0,0 +1,142 @@
+"""Hedged image requests: race a backup provider against a slow primary.
+
+Every request goes to the primary provider first. If it has not answered
+within the primary's observed p95 latency, the same request is sent to a
+backup provider and whichever returns an image first wins; the loser is
+cancelled if it has not started and otherwise left to finish unobserved.
+Hedges are capped at a fraction of all requests, so the extra provider cost
+is bounded. Latencies are tracked per provider for the whole process, so the
+deadline reflects what every session has recently seen.
+"""
+
+import collections
+import concurrent.futures
+import threading
+import time
+
+DEFAULT_MAX_HEDGE_FRACTION = 0.1
+# Deadline used until a provider has enough samples for a p95
+DEFAULT_INITIAL_DEADLINE = 30.0
+# Aspect ratios closer than this are left alone (DALL·E's 1792x1024 counts as 16:9)
+ASPECT_TOLERANCE = 0.03
+
+
+class LatencyTracker:
+    """Rolling window of a provider's recent successful request latencies."""
+
+    def __init__(self, window=200, min_samples=10):
+        self.min_samples = min_samples
+        self._samples = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, q):
+        """The ``q`` quantile of the window, or None until ``min_samples`` latencies are known."""
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+_trackers = {}
+_trackers_lock = threading.Lock()
+
+
+def latency_tracker(provider):
+    """Return the process-wide latency tracker for ``provider``."""
+    with _trackers_lock:
+        tracker = _trackers.get(provider)
+        if tracker is None:
+            tracker = _trackers[provider] = LatencyTracker()
+        return tracker
+
+
+def fit_aspect_ratio(image, aspect_ratio):
+    """Center-crop ``image`` to ``aspect_ratio`` ("16:9") unless it already matches within tolerance."""
+    width, height = (int(part) for part in aspect_ratio.split(":"))
+    target = width / height
+    current = image.width / image.height
+    if abs(current - target) / target <= ASPECT_TOLERANCE:
+        return image
+    if current > target:
+        new_width = round(image.height * target)
+        left = (image.width - new_width) // 2
+        return image.crop((left, 0, left + new_width, image.height))
+    new_height = round(image.width / target)
+    top = (image.height - new_height) // 2
+    return image.crop((0, top, image.width, top + new_height))
+
+
+def _timed(provider, generate, args):
+    started = time.monotonic()
+    result = generate(*args)
+    if result is not None:
+        latency_tracker(provider).record(time.monotonic() - started)
+    return result
+
+
+class Hedger:
+    """Call ``primary_fn(*args)``, hedging with ``backup_fn(*args)`` when the primary is slow.
+
+    ``max_hedge_fraction`` caps hedges at that share of the requests made so
+    far. ``initializer`` runs in each request thread (the UI uses it to attach
+    the Streamlit script context). Use one Hedger per run and ``close`` it.
+    """
+
+    def __init__(self, primary, backup, primary_fn, backup_fn, max_hedge_fraction=DEFAULT_MAX_HEDGE_FRACTION,
+                 quantile=0.95, initial_deadline=DEFAULT_INITIAL_DEADLINE, max_workers=8, initializer=None):
+        self.primary = primary
+        self.backup = backup
+        self.primary_fn = primary_fn
+        self.backup_fn = backup_fn
+        self.max_hedge_fraction = max_hedge_fraction
+        self.quantile = quantile
+        self.initial_deadline = initial_deadline
+        self.requests = 0
+        self.hedges = 0
+        self.backup_wins = 0
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="hedge", initializer=initializer
+        )
+
+    def deadline(self):
+        return latency_tracker(self.primary).quantile(self.quantile) or self.initial_deadline
+
+    def __call__(self, *args):
+        with self._lock:
+            self.requests += 1
+        primary = self._executor.submit(_timed, self.primary, self.primary_fn, args)
+        try:
+            return primary.result(timeout=self.deadline())
+        except concurrent.futures.TimeoutError:
+            pass
+
+        with self._lock:
+            hedge = self.hedges < self.max_hedge_fraction * self.requests
+            if hedge:
+                self.hedges += 1
+        if not hedge:
+            return primary.result()
+
+        backup = self._executor.submit(_timed, self.backup, self.backup_fn, args)
+        pending = {primary, backup}
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None and future.result() is not None:
+                    for loser in pending:
+                        loser.cancel()
+                    if future is backup:
+                        with self._lock:
+                            self.backup_wins += 1
+                    return future.result()
+        # Both answered without an image: surface the primary's error, if it had one
+        return primary.result()
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,405 @@
+"""SQLite-backed record of remote video generations so they survive reruns and restarts.
+
+Every provider generation ID is written down as soon as the provider hands it
+out, together with its state and, once downloaded, the path of its artifact.
+Polling and downloading go through ``JobStore.watch``, which keeps a single
+poller job per generation for the whole process: a Streamlit rerun that
+reattaches to a generation waits on the same future instead of polling twice,
+and ``JobStore.resume`` picks up generations that were still pending when the
+server stopped. Text-to-Video chains are recorded as well, so a chain that was
+interrupted continues from its last completed segment.
+
+API keys are never stored. When the store is first opened in a process,
+pending headless batch jobs whose provider key is set in the environment
+(``providers.API_KEY_ENV``) are resumed in the background. Jobs of UI sessions
+may have been started with a key entered in the UI, so they resume once their
+session comes back and the key is entered again.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from dataclasses import dataclass
+
+import providers
+from downloads import download_async
+from poller import JobFailed, get_poller
+
+DEFAULT_JOB_DIR = os.path.join(os.path.expanduser("~"), ".local", "share", "loom", "jobs")
+
+PENDING_STATE = "pending"
+COMPLETED_STATE = "completed"
+FAILED_STATE = "failed"
+
+# Owners of headless batch jobs are "batch:<job id>"
+BATCH_OWNER_PREFIX = "batch:"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    provider TEXT NOT NULL,
+    generation_id TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    state TEXT NOT NULL,
+    artifact TEXT NOT NULL,
+    error TEXT,
+    chain_id INTEGER,
+    segment INTEGER,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    params_hash TEXT,
+    UNIQUE (provider, generation_id)
+);
+CREATE INDEX IF NOT EXISTS jobs_owner_state ON jobs (owner, state);
+CREATE TABLE IF NOT EXISTS chains (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    owner TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    params TEXT NOT NULL,
+    state TEXT NOT NULL,
+    output TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+@dataclass(frozen=True)
+class JobRecord:
+    id: int
+    provider: str
+    generation_id: str
+    owner: str
+    state: str
+    artifact: str
+    error: str
+    chain_id: int
+    segment: int
+    created_at: float
+    updated_at: float
+    params_hash: str
+
+
+@dataclass(frozen=True)
+class ChainRecord:
+    id: int
+    owner: str
+    prompt: str
+    params: dict
+    state: str
+    output: str
+    created_at: float
+    updated_at: float
+
+
+def params_hash(params):
+    """Stable hash of a generation's settings, so a job is only reused for identical requests."""
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _rejected(error):
+    """True for HTTP errors (httpx or provider SDK) that mean the request itself is wrong: 4xx other than 429."""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return isinstance(status, int) and 400 <= status < 500 and status != 429
+
+
+def _write_artifact(data, path):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class JobStore:
+    def __init__(self, root=DEFAULT_JOB_DIR):
+        self.root = root
+        self.artifact_dir = os.path.join(root, "artifacts")
+        os.makedirs(self.artifact_dir, exist_ok=True)
+        # Reentrant: a poller callback may settle a job on the thread that is submitting it
+        self._lock = threading.RLock()
+        self._active = {}
+        self._db = sqlite3.connect(
+            os.path.join(root, "jobs.sqlite3"), check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._db.row_factory = sqlite3.Row
+        with self._lock:
+            # WAL lets several server processes read while one writes
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(_SCHEMA)
+            # Stores created before params_hash existed
+            columns = {row["name"] for row in self._db.execute("PRAGMA table_info(jobs)")}
+            if "params_hash" not in columns:
+                self._db.execute("ALTER TABLE jobs ADD COLUMN params_hash TEXT")
+
+    def _query(self, sql, args=()):
+        with self._lock:
+            return self._db.execute(sql, args).fetchall()
+
+    def _execute(self, sql, args=()):
+        with self._lock:
+            return self._db.execute(sql, args).lastrowid
+
+    # -----------------------------
+    # Jobs
+    # -----------------------------
+
+    def add(self, provider, generation_id, owner, artifact=None, chain_id=None, segment=None, params=None):
+        """Record a freshly started generation and return its ``JobRecord``.
+
+        ``params``, the settings the generation was started with, let ``reusable`` match it later.
+        """
+        artifact = artifact or os.path.join(self.artifact_dir, f"{provider}_{generation_id}.mp4")
+        now = time.time()
+        self._execute(
+            "INSERT OR IGNORE INTO jobs (provider, generation_id, owner, state, artifact, chain_id, segment,"
+            " created_at, updated_at, params_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (provider, generation_id, owner, PENDING_STATE, os.path.abspath(artifact), chain_id, segment, now, now,
+             None if params is None else params_hash(params)),
+        )
+        return self.find(provider, generation_id)
+
+    def get(self, job_id):
+        rows = self._query("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        return JobRecord(**rows[0]) if rows else None
+
+    def find(self, provider, generation_id):
+        rows = self._query("SELECT * FROM jobs WHERE provider = ? AND generation_id = ?", (provider, generation_id))
+        return JobRecord(**rows[0]) if rows else None
+
+    def jobs(self, owner=None, state=None, standalone=False, owner_prefix=None):
+        """Return jobs, oldest first, optionally limited to one owner or owner prefix, one state or jobs outside chains."""
+        sql = "SELECT * FROM jobs WHERE 1 = 1"
+        args = []
+        if owner is not None:
+            sql += " AND owner = ?"
+            args.append(owner)
+        if owner_prefix is not None:
+            sql += " AND substr(owner, 1, ?) = ?"
+            args += [len(owner_prefix), owner_prefix]
+        if state is not None:
+            sql += " AND state = ?"
+            args.append(state)
+        if standalone:
+            sql += " AND chain_id IS NULL"
+        return [JobRecord(**row) for row in self._query(sql + " ORDER BY id", args)]
+
+    def _set_state(self, job_id, state, error=None):
+        self._execute(
+            "UPDATE jobs SET state = ?, error = ?, updated_at = ? WHERE id = ?", (state, error, time.time(), job_id)
+        )
+
+    def is_active(self, job_id):
+        with self._lock:
+            return job_id in self._active
+
+    def watch(self, job, api_key, timeout=None):
+        """Return a future resolving to ``job``'s downloaded artifact path, polling the provider if needed.
+
+        Watching a generation that is already being polled in this process
+        returns the existing future. ``timeout`` bounds this wait only: the
+        job stays pending and can be watched or resumed again afterwards.
+        """
+        if job.state == COMPLETED_STATE and os.path.exists(job.artifact):
+            future = Future()
+            future.set_result(job.artifact)
+            return future
+        with self._lock:
+            future = self._active.get(job.id)
+            if future is None:
+                future = self._active[job.id] = self._fetch(job, api_key)
+                future.add_done_callback(lambda f: self._settle(job.id, f))
+        if timeout is None:
+            return future
+        return _with_timeout(future, timeout)
+
+    def _fetch(self, job, api_key):
+        """Poll ``job`` until it is done, then store its artifact; returns a future for the artifact path.
+
+        The poller only checks the status. Videos sent as a URL are fetched on
+        the shared download pool, so a download never holds a poller thread
+        and several finished jobs download in parallel.
+        """
+        initial_interval, max_interval = providers.get_adapter(job.provider).poll_intervals
+        status = get_poller().submit(
+            providers.video_check(job.provider, api_key, job.generation_id),
+            initial_interval=initial_interval,
+            max_interval=max_interval,
+            name=job.provider,
+        )
+        future = Future()
+
+        def relay(done):
+            if done.cancelled():
+                future.cancel()
+            elif done.exception() is not None:
+                _settle_future(future.set_exception, done.exception())
+            else:
+                _settle_future(future.set_result, job.artifact)
+
+        def finished(done):
+            if done.cancelled() or done.exception() is not None:
+                relay(done)
+            elif isinstance(done.result(), bytes):
+                try:
+                    _write_artifact(done.result(), job.artifact)
+                except OSError as e:
+                    _settle_future(future.set_exception, e)
+                else:
+                    _settle_future(future.set_result, job.artifact)
+            else:
+                download_async(done.result(), job.artifact).add_done_callback(relay)
+
+        status.add_done_callback(finished)
+        # Cancelling the watch stops polling
+        future.add_done_callback(lambda f: status.cancel() if f.cancelled() else None)
+        return future
+
+    def _settle(self, job_id, future):
+        with self._lock:
+            self._active.pop(job_id, None)
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is None:
+            self._set_state(job_id, COMPLETED_STATE)
+        elif isinstance(error, JobFailed):
+            self._set_state(job_id, FAILED_STATE, str(error))
+        elif _rejected(error):
+            # The provider will not serve this generation (unknown, expired, bad key); resuming cannot help
+            self._set_state(job_id, FAILED_STATE, f"{type(error).__name__}: {error}")
+        else:
+            # Network trouble and the like leave the job pending so it can be resumed
+            self._set_state(job_id, PENDING_STATE, f"{type(error).__name__}: {error}")
+
+    def reusable(self, provider, owner, artifact, params):
+        """Return the latest pending generation of ``owner`` for ``artifact`` started with the same ``params``.
+
+        Running an interrupted job again reattaches to it instead of starting
+        and paying for a new generation. Finished generations are never
+        reused, so a rerun, or a run with changed settings, generates anew.
+        """
+        rows = self._query(
+            "SELECT * FROM jobs WHERE provider = ? AND owner = ? AND artifact = ? AND params_hash = ? AND state = ?"
+            " AND chain_id IS NULL ORDER BY id DESC LIMIT 1",
+            (provider, owner, os.path.abspath(artifact), params_hash(params), PENDING_STATE),
+        )
+        return JobRecord(**rows[0]) if rows else None
+
+    def resume(self, api_keys, owner=None, owner_prefix=None):
+        """Start watching every pending job whose provider key is in ``api_keys``.
+
+        ``owner`` or ``owner_prefix`` limit this to one owner's jobs or to owners starting with the prefix.
+
+        Returns the list of ``(job, future)`` pairs for the jobs being watched.
+        """
+        watched = []
+        for job in self.jobs(owner=owner, state=PENDING_STATE, owner_prefix=owner_prefix):
+            api_key = api_keys.get(job.provider)
+            if api_key:
+                watched.append((job, self.watch(job, api_key)))
+        return watched
+
+    # -----------------------------
+    # Text-to-Video chains
+    # -----------------------------
+
+    def _chain(self, row):
+        return ChainRecord(**dict(row, params=json.loads(row["params"])))
+
+    def start_chain(self, owner, prompt, params):
+        """Return the unfinished chain of ``owner`` with the same prompt and settings, or record a new one."""
+        encoded = json.dumps(params, sort_keys=True)
+        rows = self._query(
+            "SELECT * FROM chains WHERE owner = ? AND prompt = ? AND params = ? AND state = ? ORDER BY id DESC LIMIT 1",
+            (owner, prompt, encoded, PENDING_STATE),
+        )
+        if rows:
+            return self._chain(rows[0])
+        now = time.time()
+        chain_id = self._execute(
+            "INSERT INTO chains (owner, prompt, params, state, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (owner, prompt, encoded, PENDING_STATE, now, now),
+        )
+        return self._chain(self._query("SELECT * FROM chains WHERE id = ?", (chain_id,))[0])
+
+    def chains(self, owner=None, state=None):
+        sql = "SELECT * FROM chains WHERE 1 = 1"
+        args = []
+        if owner is not None:
+            sql += " AND owner = ?"
+            args.append(owner)
+        if state is not None:
+            sql += " AND state = ?"
+            args.append(state)
+        return [self._chain(row) for row in self._query(sql + " ORDER BY id", args)]
+
+    def chain_segments(self, chain_id):
+        """Return ``{segment: JobRecord}`` for the latest usable generation of every segment of a chain."""
+        segments = {}
+        for job in self._query("SELECT * FROM jobs WHERE chain_id = ? ORDER BY id", (chain_id,)):
+            if job["state"] != FAILED_STATE:
+                segments[job["segment"]] = JobRecord(**job)
+        return segments
+
+    def finish_chain(self, chain_id, output):
+        """Mark a chain complete and delete its segment artifacts, which now live on in ``output``."""
+        self._execute(
+            "UPDATE chains SET state = ?, output = ?, updated_at = ? WHERE id = ?",
+            (COMPLETED_STATE, output, time.time(), chain_id),
+        )
+        for job in self.chain_segments(chain_id).values():
+            if os.path.exists(job.artifact):
+                os.remove(job.artifact)
+
+
+def _settle_future(resolve, value):
+    try:
+        resolve(value)
+    except InvalidStateError:
+        pass  # cancelled, or the other side got there first
+
+
+def _with_timeout(future, timeout):
+    """Wrap ``future`` in one that fails with TimeoutError after ``timeout`` seconds without cancelling it."""
+    waiter = Future()
+
+    def expire():
+        _settle_future(waiter.set_exception, TimeoutError(f"Job still pending after {timeout} seconds"))
+
+    def relay(done):
+        timer.cancel()
+        if done.cancelled():
+            waiter.cancel()
+        elif done.exception() is not None:
+            _settle_future(waiter.set_exception, done.exception())
+        else:
+            _settle_future(waiter.set_result, done.result())
+
+    timer = threading.Timer(timeout, expire)
+    timer.daemon = True
+    timer.start()
+    future.add_done_callback(relay)
+    return waiter
+
+
+_job_store = None
+_job_store_lock = threading.Lock()
+
+
+def get_job_store():
+    """Return the process-wide job store, kept under ``LOOM_JOB_DIR``.
+
+    Opening it resumes every pending batch job whose provider key is in the environment.
+    """
+    global _job_store
+    with _job_store_lock:
+        if _job_store is None:
+            _job_store = JobStore(os.environ.get("LOOM_JOB_DIR", DEFAULT_JOB_DIR))
+            _job_store.resume(providers.environment_api_keys(), owner_prefix=BATCH_OWNER_PREFIX)
+    return _job_store
@@ -1,352 +1,206 @@
 import streamlit as st
-from lumaai import LumaAI
-import runwayml
-import replicate
-import requests
 import time
-import base64
-from PIL import Image
-import io
-from moviepy.editor import VideoFileClip, concatenate_videoclips, CompositeVideoClip, vfx, ImageClip
 import os
 import sys
-import numpy as np
 import traceback
-import zipfile
+import secrets
+import threading
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from engine import (
+    PROVIDER_CONCURRENCY, cached_image, generate_image, generate_image_from_text_flux, generate_image_hedged,
+    generate_images_from_text_flux, generate_video_luma, generate_video_runwayml, luma_generation_params,
+    run_image_to_video, run_snapshot, run_text_to_video
+)
+from media import MediaStore, remove_stale_dirs
+from providers import luma_camera_motions, preload
+from export import ZipExport
+from metrics import get_metrics
+from jobs import COMPLETED_STATE, PENDING_STATE, get_job_store
 
 # Redirect stderr to stdout to capture all logs in Streamlit
 sys.stderr = sys.stdout
 
+# Files under static/ are served by Streamlit when server.enableStaticServing is on
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+# Streamlit answers 404 for larger static files (MAX_APP_STATIC_FILE_SIZE)
+MAX_STATIC_FILE_SIZE = 200 * 1024 * 1024
+
 # -----------------------------
 # Initialize Session State
 # -----------------------------
-if 'generations' not in st.session_state:
-    st.session_state.generations = []  # List to store generation metadata
-if 'generated_images' not in st.session_state:
-    st.session_state.generated_images = []
-if 'generated_videos' not in st.session_state:
-    st.session_state.generated_videos = []
-if 'final_video' not in st.session_state:
-    st.session_state.final_video = None
+def init_session_state():
+    if 'generations' not in st.session_state:
+        st.session_state.generations = []  # List to store generation metadata
+    if 'media_store' not in st.session_state:
+        st.session_state.media_store = MediaStore()  # Per-session directory holding generated images
+    if 'generated_images' not in st.session_state:
+        st.session_state.generated_images = []  # MediaHandle records; pixels stay on disk in media_store
+    if not st.session_state.media_store.touch():
+        # The session sat idle past SESSION_MAX_AGE and its images were cleaned up
+        st.session_state.generated_images = []
+    if 'generated_videos' not in st.session_state:
+        st.session_state.generated_videos = []
+    if 'final_video' not in st.session_state:
+        st.session_state.final_video = None
+    if 'zip_export' not in st.session_state:
+        exports_dir = os.path.join(STATIC_DIR, "exports")
+        remove_stale_dirs(exports_dir)  # exports of sessions that have ended
+        # Unguessable per-session directory, since static files are served to anyone with the URL
+        st.session_state.zip_export = ZipExport(
+            os.path.join(exports_dir, secrets.token_hex(16), "generated_content.zip")
+        )
 
 # -----------------------------
 # Helper Functions
 # -----------------------------
 
-def resize_image(image, target_size):
-    return image.resize(target_size)
-
-def generate_image_from_text_stability(api_key, prompt):
-    url = "https://api.stability.ai/v1beta/generation/stable-diffusion-v1-6/text-to-image"
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-    }
-    data = {
-        "text_prompts": [{"text": prompt}],
-        "cfg_scale": 7,
-        "height": 768,
-        "width": 768,
-        "samples": 1,
-        "steps": 30,
-    }
-    try:
-        response = requests.post(url, headers=headers, json=data)
-        response.raise_for_status()
-        image_data = response.json()['artifacts'][0]['base64']
-        image = Image.open(io.BytesIO(base64.b64decode(image_data)))
-        return image
-    except requests.exceptions.RequestException as e:
-        st.error(f"Error generating image with Stable Diffusion: {str(e)}")
-        return None
-
-def generate_image_from_text_flux(prompt, aspect_ratio, output_format, output_quality, safety_tolerance, prompt_upsampling):
-    try:
-        output = replicate.run(
-            "black-forest-labs/flux-1.1-pro",
-            input={
-                "prompt": prompt,
-                "aspect_ratio": aspect_ratio,
-                "output_format": output_format,
-                "output_quality": output_quality,
-                "safety_tolerance": safety_tolerance,
-                "prompt_upsampling": prompt_upsampling
-            }
-        )
-        # Access the URL directly from the FileOutput object
-        image_url = output.url
-        image_response = requests.get(image_url)
-        image = Image.open(io.BytesIO(image_response.content))
-        return image
-    except Exception as e:
-        st.error(f"Error generating image with Flux: {e}")
-        st.error(traceback.format_exc())
-        return None
-
-def generate_image_from_text_dalle(api_key, prompt, size, quality):
-    url = "https://api.openai.com/v1/images/generations"
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-    }
-    data = {
-        "model": "dall-e-3",
-        "prompt": prompt,
-        "n": 1,
-        "size": size,
-        "response_format": "url",
-        "quality": quality  # "standard" or "hd"
-    }
-    try:
-        response = requests.post(url, headers=headers, json=data)
-        response.raise_for_status()
-        response_data = response.json()
-        image_url = response_data['data'][0]['url']
-        # Optionally, you can access the revised prompt
-        revised_prompt = response_data['data'][0].get('revised_prompt', '')
-        if revised_prompt:
-            st.write(f"**Revised Prompt:** {revised_prompt}")
-        # Download image
-        image_response = requests.get(image_url)
-        image = Image.open(io.BytesIO(image_response.content))
-        return image
-    except Exception as e:
-        st.error(f"Error generating image with DALL·E: {e}")
-        st.error(traceback.format_exc())
-        return None
-
-def start_video_generation_stability(api_key, image, cfg_scale=1.8, motion_bucket_id=127, seed=0):
-    url = "https://api.stability.ai/v2beta/image-to-video"
-    headers = {
-        "Authorization": f"Bearer {api_key}"
-    }
-    img_byte_arr = io.BytesIO()
-    image.save(img_byte_arr, format='PNG')
-    img_byte_arr = img_byte_arr.getvalue()
-    files = {
-        "image": ("image.png", img_byte_arr, "image/png")
-    }
-    data = {
-        "seed": str(seed),
-        "cfg_scale": str(cfg_scale),
-        "motion_bucket_id": str(motion_bucket_id)
-    }
-    try:
-        response = requests.post(url, headers=headers, files=files, data=data)
-        response.raise_for_status()
-        return response.json().get('id')
-    except requests.exceptions.RequestException as e:
-        st.error(f"Error starting video generation with Stability AI: {str(e)}")
-        return None
-
-def poll_for_video_stability(api_key, generation_id):
-    url = f"https://api.stability.ai/v2beta/image-to-video/result/{generation_id}"
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Accept": "video/*"
-    }
-    max_attempts = 60
-    for attempt in range(max_attempts):
-        try:
-            response = requests.get(url, headers=headers)
-            if response.status_code == 202:
-                st.write(f"Video generation in progress... Polling attempt {attempt + 1}/{max_attempts}")
-                time.sleep(10)
-            elif response.status_code == 200:
-                return response.content
-            else:
-                response.raise_for_status()
-        except requests.exceptions.RequestException as e:
-            st.error(f"Error polling for video with Stability AI: {str(e)}")
-            return None
-    st.error("Video generation timed out with Stability AI. Please try again.")
-    return None
-
-def validate_video_clip(video_path):
-    if not os.path.exists(video_path):
-        st.error(f"Video file not found: {video_path}")
-        return False
-    try:
-        clip = VideoFileClip(video_path)
-        if clip is None:
-            st.error(f"Failed to load video clip: {video_path}")
-            return False
-        duration = clip.duration
-        clip.close()
-        st.write(f"Validated video clip: {video_path}, Duration: {duration} seconds")
-        return duration > 0
-    except Exception as e:
-        st.error(f"Invalid video segment: {video_path}, Error: {str(e)}")
-        return False
-
-def get_last_frame_image(video_path):
-    if not os.path.exists(video_path):
-        st.error(f"Video file not found: {video_path}")
-        return None
-    try:
-        video_clip = VideoFileClip(video_path)
-        if video_clip is None:
-            st.error(f"Failed to load video clip: {video_path}")
-            return None
-        if video_clip.duration <= 0:
-            st.error(f"Invalid video duration for {video_path}")
-            video_clip.close()
-            return None
-        last_frame = video_clip.get_frame(video_clip.duration - 0.001)
-        last_frame_image = Image.fromarray(np.uint8(last_frame)).convert('RGB')
-        video_clip.close()
-        return last_frame_image
-    except Exception as e:
-        st.error(f"Error extracting last frame from {video_path}: {str(e)}")
-        return None
-
-def concatenate_videos(video_clips, crossfade_duration=0):
-    valid_clips = []
-    for clip_path in video_clips:
-        st.write(f"Attempting to load clip: {clip_path}")
-        if validate_video_clip(clip_path):
-            try:
-                clip = VideoFileClip(clip_path)
-                if clip is not None and clip.duration > 0:
-                    valid_clips.append(clip)
-                    st.write(f"Successfully loaded clip: {clip_path}, Duration: {clip.duration} seconds")
-                else:
-                    st.warning(f"Skipping invalid clip: {clip_path}")
-            except Exception as e:
-                st.warning(f"Error loading clip {clip_path}: {str(e)}")
-        else:
-            st.warning(f"Validation failed for clip: {clip_path}")
+def session_owner():
+    """Token that owns this browser session's jobs; kept in the URL so a reload reattaches to them."""
+    owner = st.query_params.get("session")
+    if not owner:
+        owner = st.session_state.get("owner") or secrets.token_hex(16)
+        st.query_params["session"] = owner
+    st.session_state.owner = owner
+    return owner
+
+def reattach_jobs(job_store, owner, api_keys):
+    """Resume this session's unfinished generations and pick up any that finished since the last run."""
+    job_store.resume(api_keys, owner=owner)
+    known = {os.path.abspath(path) for path in st.session_state.generated_videos}
+    finished = [job.artifact for job in job_store.jobs(owner=owner, state=COMPLETED_STATE, standalone=True)]
+    finished += [chain.output for chain in job_store.chains(owner=owner, state=COMPLETED_STATE)]
+    for path in finished:
+        if path and os.path.exists(path) and path not in known:
+            st.session_state.generated_videos.append(path)
+            st.session_state.final_video = path
+            known.add(path)
+
+    pending = job_store.jobs(owner=owner, state=PENDING_STATE)
+    unfinished_chains = job_store.chains(owner=owner, state=PENDING_STATE)
+    if pending or unfinished_chains:
+        with st.expander(f"⏳ {len(pending)} generation(s) in progress"):
+            for job in pending:
+                waiting = "" if job_store.is_active(job.id) else " (enter the API key to resume)"
+                started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(job.created_at))
+                st.write(f"{job.provider} generation `{job.generation_id}`, started {started}{waiting}")
+            for chain in unfinished_chains:
+                st.write(f"Unfinished Text-to-Video chain: \"{chain.prompt}\". Generate again with the same settings to continue it.")
+            if st.button("🔄 Refresh", key="refresh_jobs"):
+                st.rerun()
+
+def report(level, message):
+    """Show an engine progress or error message on the page."""
+    if level == "error":
+        st.error(message)
+    elif level == "warning":
+        st.warning(message)
+    elif level == "success":
+        st.success(message)
+    else:
+        st.write(message)
 
-    if not valid_clips:
-        st.error("No valid video segments found. Unable to concatenate.")
-        return None, None
+def attach_script_context():
+    """Thread initializer letting engine worker threads report to the page that started them."""
+    ctx = get_script_run_ctx()
+    return lambda: add_script_run_ctx(threading.current_thread(), ctx)
 
-    try:
-        st.write(f"Attempting to concatenate {len(valid_clips)} valid clips")
-        
-        # Trim the last frame from all clips except the last one
-        trimmed_clips = []
-        for i, clip in enumerate(valid_clips):
-            if i < len(valid_clips) - 1:
-                # Subtract a small duration (e.g., 1/30 second) to remove approximately one frame
-                trimmed_clip = clip.subclip(0, clip.duration - 1/30)
-                trimmed_clips.append(trimmed_clip)
-            else:
-                trimmed_clips.append(clip)
-
-        if crossfade_duration > 0:
-            st.write(f"Applying crossfade of {crossfade_duration} seconds")
-            # Apply crossfade transition
-            final_clips = []
-            for i, clip in enumerate(trimmed_clips):
-                if i == 0:
-                    final_clips.append(clip)
-                else:
-                    # Create a crossfade transition
-                    fade_out = trimmed_clips[i-1].fx(vfx.fadeout, duration=crossfade_duration)
-                    fade_in = clip.fx(vfx.fadein, duration=crossfade_duration)
-                    transition = CompositeVideoClip([fade_out, fade_in])
-                    transition = transition.set_duration(crossfade_duration)
-                    
-                    # Add the transition and the full clip
-                    final_clips.append(transition)
-                    final_clips.append(clip)
-            
-            final_video = concatenate_videoclips(final_clips)
-        else:
-            final_video = concatenate_videoclips(trimmed_clips)
+def store_generated_image(image):
+    """Write a generated image to the session media store and keep only its handle in session state."""
+    handle = st.session_state.media_store.add_image(image)
+    st.session_state.generated_images.append(handle)
+    return handle
 
-        st.write(f"Concatenation successful. Final video duration: {final_video.duration} seconds")
-        return final_video, valid_clips
-    except Exception as e:
-        st.error(f"Error concatenating videos: {str(e)}")
-        for clip in valid_clips:
-            clip.close()
-        return None, None
-
-def create_video_from_images(images, fps, output_path):
-    clips = [ImageClip(np.array(img)).set_duration(1/fps) for img in images]
-    video = concatenate_videoclips(clips, method="compose")
-    video.write_videofile(output_path, fps=fps, codec="libx264")
-    return output_path
-
-def create_zip_file(images, videos, output_path="generated_content.zip"):
+def create_zip_file(images, videos):
+    """Update the session's on-disk ZIP export with the current images and videos and return its path."""
     if not images and not videos:
         st.error("No images or videos to create a zip file.")
         return None
 
     try:
-        with zipfile.ZipFile(output_path, 'w') as zipf:
-            for i, img in enumerate(images):
-                img_path = f"image_{i+1}.png"
-                img.save(img_path)
-                zipf.write(img_path)
-                os.remove(img_path)
-            
-            for video in videos:
-                if os.path.exists(video):
-                    zipf.write(video)
-                else:
-                    st.warning(f"Video file not found: {video}")
-        
-        return output_path
+        files = [(f"image_{i+1}.{handle.extension}", handle.path) for i, handle in enumerate(images)]
+        video_files = {}
+        for video in videos:
+            if os.path.exists(video):
+                video_files[os.path.basename(video)] = video
+            else:
+                st.warning(f"Video file not found: {video}")
+        files.extend(video_files.items())
+        return st.session_state.zip_export.update(files)
     except Exception as e:
         st.error(f"Error creating zip file: {str(e)}")
         return None
 
-def display_images_in_grid(images, columns=3):
-    """Display images in a grid layout with captions."""
-    for i in range(0, len(images), columns):
+def display_images_in_grid(images, columns=3, page_size=24, key="image_grid"):
+    """Display one page of cached thumbnails in a grid; full-size images load only when requested."""
+    store = st.session_state.media_store
+    num_pages = max(1, (len(images) + page_size - 1) // page_size)
+    if num_pages > 1:
+        page = st.number_input(f"Page (1-{num_pages})", min_value=1, max_value=num_pages, value=1, key=f"{key}_page")
+    else:
+        page = 1
+    full_size_view = st.container()
+
+    start = (page - 1) * page_size
+    page_images = images[start:start + page_size]
+    for i in range(0, len(page_images), columns):
         cols = st.columns(columns)
         for j in range(columns):
-            if i + j < len(images):
+            if i + j < len(page_images):
+                idx = start + i + j
                 with cols[j]:
-                    st.image(images[i + j], use_column_width=True, caption=f"Image {i + j + 1}")
-                    st.markdown(f"<p style='text-align: center;'>Image {i + j + 1}</p>", unsafe_allow_html=True)
-
-def generate_video_runwayml(runway_api_key, prompt_image_url, prompt_text):
-    client = runwayml.RunwayML(api_key=runway_api_key)
-    try:
-        response = client.image_to_video.create(
-            model="gen3a_turbo",
-            prompt_image=prompt_image_url,
-            prompt_text=prompt_text,
-        )
-        generation_id = response.id
-        st.write(f"RunwayML Video Generation ID: {generation_id}")
-        # Poll until completion
-        while True:
-            generation = client.image_to_video.get(id=generation_id)
-            if generation.state == "completed":
-                st.success("RunwayML Video Generation Completed.")
-                video_url = generation.assets.video
-                # Download video
-                video_response = requests.get(video_url)
-                video_path = f"runwayml_video_{generation_id}.mp4"
-                with open(video_path, "wb") as f:
-                    f.write(video_response.content)
-                st.write(f"✅ Saved RunwayML video to {video_path}")
-                st.session_state.generated_videos.append(video_path)
-                st.session_state.final_video = video_path
-                st.video(video_path)
-                break
-            elif generation.state == "failed":
-                st.error(f"RunwayML Video Generation Failed: {generation.failure_reason}")
-                break
-            else:
-                st.write("⌛ RunwayML Video Generation in progress... Waiting for completion.")
-                time.sleep(10)
-    except runwayml.APIConnectionError as e:
-        st.error("RunwayML API Connection Error.")
-        st.error(e.__cause__)  # an underlying Exception, likely raised within httpx.
-    except runwayml.RateLimitError as e:
-        st.error("RunwayML Rate Limit Exceeded. Please wait and try again.")
-    except runwayml.APIStatusError as e:
-        st.error(f"RunwayML API returned an error: {e.status_code}")
-        st.error(e.response)
-    except Exception as e:
-        st.error(f"An unexpected error occurred with RunwayML: {e}")
-        st.error(traceback.format_exc())
+                    st.image(store.thumbnail(page_images[i + j]), use_column_width=True, caption=f"Image {idx + 1}")
+                    if st.button("🔍 Full size", key=f"{key}_full_{idx}"):
+                        st.session_state[f"{key}_full"] = idx
+
+    full_idx = st.session_state.get(f"{key}_full")
+    if full_idx is not None and full_idx < len(images):
+        with full_size_view:
+            handle = images[full_idx]
+            st.image(handle.path, use_column_width=True, caption=f"Image {full_idx + 1} ({handle.width}x{handle.height})")
+            if st.button("✖️ Close", key=f"{key}_close"):
+                del st.session_state[f"{key}_full"]
+                st.rerun()
+
+def format_labels(labels):
+    return ", ".join(f"{name}={value}" for name, value in sorted(labels.items()))
+
+def display_performance_panel():
+    """Show where this server's time went, per pipeline stage, since it started."""
+    snapshot = get_metrics().snapshot()
+    if not snapshot["stages"]:
+        st.info("⏱️ No timings recorded yet. Generate something first.")
+        return
+    st.button("🔄 Refresh", key="performance_refresh")
+    st.write("#### Stages (slowest total first)")
+    st.dataframe([
+        {
+            "Stage": row["stage"],
+            "Labels": format_labels(row["labels"]),
+            "Count": row["count"],
+            "Errors": row["errors"],
+            "Total (s)": round(row["total_seconds"], 2),
+            "Mean (s)": round(row["mean_seconds"], 3),
+            "Max (s)": round(row["max_seconds"], 3),
+        }
+        for row in snapshot["stages"]
+    ], use_container_width=True)
+    if snapshot["counters"]:
+        st.write("#### Counters")
+        st.dataframe([
+            {"Counter": row["name"], "Labels": format_labels(row["labels"]), "Value": row["value"]}
+            for row in snapshot["counters"]
+        ], use_container_width=True)
+    with st.expander(f"Last {len(snapshot['recent'])} spans"):
+        st.dataframe([
+            {
+                "Ended": time.strftime("%H:%M:%S", time.localtime(span["ended"])),
+                "Stage": span["stage"],
+                "Labels": format_labels(span["labels"]),
+                "Seconds": round(span["seconds"], 3),
+                "Failed": span["failed"],
+            }
+            for span in reversed(snapshot["recent"])
+        ], use_container_width=True)
 
 # -----------------------------
 # Main Application Function
@@ -356,6 +210,7 @@ def main():
     # Streamlit Page Configuration
     # -------------------------
     st.set_page_config(page_title="AI Video Suite", layout="wide", page_icon="🎬")
+    init_session_state()
     
     # -------------------------
     # Custom CSS for Enhanced UI
@@ -449,7 +304,7 @@ def main():
     # -------------------------
     # Sidebar Navigation with Tabs
     # -------------------------
-    sidebar_tabs = st.sidebar.tabs(["🔑 API Keys", "ℹ️ About"])
+    sidebar_tabs = st.sidebar.tabs(["🔑 API Keys", "⏱️ Performance", "ℹ️ About"])
 
     # API Keys Tab
     with sidebar_tabs[0]:
@@ -461,8 +316,13 @@ def main():
         st.text_input("Enter your OpenAI API Key (for DALL·E)", type="password", key="openai_api_key")
         st.text_input("Enter your RunwayML API Key", type="password", key="runway_api_key")
 
-    # About Tab
+    # Performance Tab
     with sidebar_tabs[1]:
+        st.header("⏱️ Performance")
+        display_performance_panel()
+
+    # About Tab
+    with sidebar_tabs[2]:
         st.header("ℹ️ About")
         st.markdown("""
         ### **AI Video Suite**
@@ -547,16 +407,17 @@ def main():
         st.stop()
 
     # -------------------------
-    # Initialize Luma AI Client
+    # Load the SDKs of providers with a key in the background, ahead of the first request
     # -------------------------
-    if luma_api_key:
-        try:
-            luma_client = LumaAI(auth_token=luma_api_key)
-        except Exception as e:
-            st.error(f"❌ Error initializing Luma AI client: {e}")
-            luma_client = None
-    else:
-        luma_client = None
+    preload([name for name, key in (("replicate", replicate_api_key), ("runwayml", runway_api_key),
+                                    ("luma", luma_api_key)) if key])
+
+    # -------------------------
+    # Reattach to Generations from Earlier Runs
+    # -------------------------
+    job_store = get_job_store()
+    owner = session_owner()
+    reattach_jobs(job_store, owner, {"stability": stability_api_key, "runwayml": runway_api_key, "luma": luma_api_key})
 
     # -------------------------
     # Main Tabs: Generator, Images, Videos
@@ -592,6 +453,42 @@ def main():
                 aspect_ratio = st.selectbox("Aspect Ratio", ["1:1", "16:9", "9:16"], key="snapshot_aspect_ratio")
             else:
                 aspect_ratio = "1:1"
+            if snapshot_generator == "Flux":
+                # Predictions for every frame are submitted up front, so there is nothing to tune
+                max_workers = None
+                st.caption("Flux predictions for all frames are submitted to Replicate at once.")
+            else:
+                max_workers = st.slider(
+                    "Parallel requests",
+                    1, 16, PROVIDER_CONCURRENCY.get(snapshot_generator, 4),
+                    key=f"snapshot_max_workers_{snapshot_generator}",
+                    help="How many images are requested from the provider at the same time."
+                )
+            use_cache = st.checkbox(
+                "♻️ Reuse cached images for identical settings",
+                value=False,
+                key="snapshot_use_cache",
+                help="Frames generated earlier with the same generator, prompt and settings are returned instantly instead of being regenerated."
+            )
+            image_keys = {"DALL·E": openai_api_key, "Stable Diffusion": stability_api_key, "Flux": replicate_api_key}
+            hedge_generator = None
+            max_hedge_percent = 10
+            if st.checkbox(
+                "⚡ Hedge slow requests with a backup provider",
+                value=False,
+                key="snapshot_hedge",
+                help="Frames slower than the provider's recent 95th percentile are also requested from the backup, and the first image wins."
+            ):
+                hedge_options = [name for name, key in image_keys.items() if key and name != snapshot_generator]
+                if hedge_options:
+                    hedge_generator = st.selectbox("Backup provider", hedge_options, key="snapshot_hedge_generator")
+                    max_hedge_percent = st.slider(
+                        "Max share of hedged frames (%)", 1, 50, 10,
+                        key="snapshot_max_hedge_percent",
+                        help="Caps the extra cost: at most this share of frames is also sent to the backup provider."
+                    )
+                else:
+                    st.warning("🔑 Enter an API key for a second image provider to hedge requests.")
 
             # Check for required API keys
             if snapshot_generator == "Stable Diffusion" and not stability_api_key:
@@ -611,43 +508,19 @@ def main():
 
                 try:
                     st.success(f"🔄 Generating {num_images} images using {snapshot_generator}...")
-                    images = []
-                    for i in range(num_images):
-                        st.write(f"Generating image {i+1}/{num_images}...")
-                        if snapshot_generator == "Stable Diffusion":
-                            image = generate_image_from_text_stability(stability_api_key, prompt)
-                        elif snapshot_generator == "Flux":
-                            image = generate_image_from_text_flux(
-                                prompt,
-                                aspect_ratio=aspect_ratio,
-                                output_format="png",
-                                output_quality=80,
-                                safety_tolerance=2,
-                                prompt_upsampling=True
-                            )
-                        elif snapshot_generator == "DALL·E":
-                            if aspect_ratio == "1:1":
-                                size = "1024x1024"
-                            elif aspect_ratio == "16:9":
-                                size = "1792x1024"
-                            elif aspect_ratio == "9:16":
-                                size = "1024x1792"
-                            quality = "standard"  # or "hd"
-                            image = generate_image_from_text_dalle(openai_api_key, prompt, size, quality)
-                        else:
-                            st.error(f"🚫 Unsupported generator: {snapshot_generator}")
-                            continue
-                        if image:
-                            images.append(image)
-                            st.session_state.generated_images.append(image)
-                        else:
-                            st.error(f"❌ Failed to generate image {i+1}")
-
-                    if images:
+                    progress = st.progress(0.0)
+                    st.write("🎞️ Encoding video while images are generated...")
+                    video_path = run_snapshot(
+                        snapshot_generator, prompt, aspect_ratio, num_images, fps, "snapshot_mode_video.mp4",
+                        stability_api_key, openai_api_key, max_workers=max_workers, use_cache=use_cache,
+                        report=report, on_image=store_generated_image,
+                        hedge_generator=hedge_generator, max_hedge_fraction=max_hedge_percent / 100,
+                        on_progress=lambda done, total: progress.progress(done / total, text=f"Generated image {done}/{total}"),
+                        # Worker threads need the script context so provider errors still reach the page
+                        initializer=attach_script_context()
+                    )
+                    if video_path:
                         st.success("✅ All images generated successfully!")
-                        st.write("🎞️ Creating video from generated images...")
-                        video_path = "snapshot_mode_video.mp4"
-                        create_video_from_images(images, fps, video_path)
                         st.session_state.generated_videos.append(video_path)
                         st.session_state.final_video = video_path
                         st.success(f"🎬 Snapshot Mode video created: {video_path}")
@@ -671,6 +544,7 @@ def main():
             seed = st.number_input("Seed (0 for random)", min_value=0, max_value=4294967294, value=0, key="stability_seed")
             num_segments = st.slider("Number of video segments to generate", 1, 60, 5, key="stability_num_segments")
             crossfade_duration = st.slider("Crossfade Duration (seconds)", 0.0, 2.0, 0.0, 0.01, key="stability_crossfade")
+            use_cache = st.checkbox("♻️ Reuse cached results for seeded runs", value=False, key="stability_use_cache", help="Only applies when a non-zero seed is set.")
 
             if st.button("🎥 Generate Video with Stability AI"):
                 if not prompt:
@@ -678,79 +552,21 @@ def main():
                     st.stop()
 
                 try:
-                    st.success("🔄 Generating initial image from text prompt...")
-                    image = generate_image_from_text_stability(stability_api_key, prompt)
-                    if image is None:
-                        st.error("❌ Failed to generate the initial image.")
-                        st.stop()
-                    image = resize_image(image, (768, 768))
-                    st.session_state.generated_images.append(image)
-                    
-                    video_clips = []
-                    current_image = image
-
-                    for i in range(num_segments):
-                        st.write(f"🎞️ Generating video segment {i+1}/{num_segments}...")
-                        generation_id = start_video_generation_stability(stability_api_key, current_image, cfg_scale, motion_bucket_id, seed)
-
-                        if generation_id:
-                            video_content = poll_for_video_stability(stability_api_key, generation_id)
-
-                            if video_content:
-                                video_path = f"video_segment_{i+1}.mp4"
-                                with open(video_path, "wb") as f:
-                                    f.write(video_content)
-                                st.write(f"✅ Saved video segment to {video_path}")
-                                video_clips.append(video_path)
-                                st.session_state.generated_videos.append(video_path)
-
-                                last_frame_image = get_last_frame_image(video_path)
-                                if last_frame_image:
-                                    current_image = last_frame_image
-                                    st.session_state.generated_images.append(current_image)
-                                else:
-                                    st.warning(f"⚠️ Could not extract last frame from segment {i+1}. Using previous image.")
-                            else:
-                                st.error(f"❌ Failed to retrieve video content for segment {i+1}.")
-                        else:
-                            st.error(f"❌ Failed to start video generation for segment {i+1}.")
+                    final_video_path = run_text_to_video(
+                        stability_api_key, prompt, "longform_video.mp4",
+                        num_segments=num_segments, cfg_scale=cfg_scale, motion_bucket_id=motion_bucket_id, seed=seed,
+                        crossfade_duration=crossfade_duration, use_cache=use_cache, report=report,
+                        on_image=store_generated_image, on_segment=st.session_state.generated_videos.append,
+                        job_store=job_store, owner=owner
+                    )
+                    if final_video_path:
+                        st.session_state.final_video = final_video_path
+                        st.video(final_video_path)
 
-                    if video_clips:
-                        st.success("🔗 Concatenating video segments into one longform video...")
-                        final_video, valid_clips = concatenate_videos(video_clips, crossfade_duration=crossfade_duration)
-                        if final_video:
-                            try:
-                                final_video_path = "longform_video.mp4"
-                                final_video.write_videofile(final_video_path, codec="libx264", audio_codec="aac")
-                                st.session_state.final_video = final_video_path
-                                st.success(f"🎬 Longform video created: {final_video_path}")
-                                st.video(final_video_path)
-                            except Exception as e:
-                                st.error(f"❌ Error writing final video: {str(e)}")
-                                st.write("📜 Traceback:", traceback.format_exc())
-                            finally:
-                                if final_video:
-                                    final_video.close()
-                                if valid_clips:
-                                    for clip in valid_clips:
-                                        clip.close()
-                            
-                            # Clean up individual video segments
-                            for video_file in video_clips:
-                                if os.path.exists(video_file):
-                                    os.remove(video_file)
-                                    st.write(f"🗑️ Removed temporary file: {video_file}")
-                                else:
-                                    st.warning(f"⚠️ Could not find file to remove: {video_file}")
-                        else:
-                            st.error("❌ Failed to create the final video.")
-                        
                         # Final Video Display
                         if st.session_state.final_video and os.path.exists(st.session_state.final_video):
                             st.write(f"### 🎞️ Final Video: {st.session_state.final_video}")
                             st.video(st.session_state.final_video)
-                    else:
-                        st.error("❌ No video segments were successfully generated.")
 
                 except Exception as e:
                     st.error(f"❗ An unexpected error occurred: {str(e)}")
@@ -766,34 +582,22 @@ def main():
             cfg_scale = st.slider("CFG Scale (Controls adherence to prompt)", 0.0, 10.0, 1.8, key="stability_image_cfg_scale")
             motion_bucket_id = st.slider("Motion Bucket ID (1-255)", 1, 255, 127, key="stability_image_motion_bucket")
             seed = st.number_input("Seed (0 for random)", min_value=0, max_value=4294967294, value=0, key="stability_image_seed")
+            use_cache = st.checkbox("♻️ Reuse cached results for seeded runs", value=False, key="stability_image_use_cache", help="Only applies when a non-zero seed is set.")
 
             if st.button("🎥 Generate Video from Image"):
                 if not image_file:
                     st.error("❗ Please upload an image.")
                     st.stop()
                 try:
-                    image = Image.open(image_file)
-                    image = resize_image(image, (768, 768))
-                    st.session_state.generated_images.append(image)
-
-                    st.success("🔄 Starting video generation from uploaded image...")
-                    generation_id = start_video_generation_stability(stability_api_key, image, cfg_scale, motion_bucket_id, seed)
-
-                    if generation_id:
-                        video_content = poll_for_video_stability(stability_api_key, generation_id)
-
-                        if video_content:
-                            video_path = "image_to_video.mp4"
-                            with open(video_path, "wb") as f:
-                                f.write(video_content)
-                            st.success(f"✅ Image-to-Video created: {video_path}")
-                            st.session_state.generated_videos.append(video_path)
-                            st.session_state.final_video = video_path
-                            st.video(video_path)
-                        else:
-                            st.error("❌ Failed to retrieve video content.")
-                    else:
-                        st.error("❌ Failed to start video generation.")
+                    video_path = run_image_to_video(
+                        stability_api_key, image_file, "image_to_video.mp4",
+                        cfg_scale=cfg_scale, motion_bucket_id=motion_bucket_id, seed=seed, use_cache=use_cache,
+                        report=report, on_image=store_generated_image, job_store=job_store, owner=owner
+                    )
+                    if video_path:
+                        st.session_state.generated_videos.append(video_path)
+                        st.session_state.final_video = video_path
+                        st.video(video_path)
 
                 except Exception as e:
                     st.error(f"❗ An unexpected error occurred: {e}")
@@ -810,39 +614,104 @@ def main():
             output_quality = st.slider("Output Quality", 1, 100, 80, key="replicate_output_quality")
             safety_tolerance = st.slider("Safety Tolerance", 0, 5, 2, key="replicate_safety_tolerance")
             prompt_upsampling = st.checkbox("Prompt Upsampling", value=True, key="replicate_prompt_upsampling")
+            num_images = st.slider(
+                "Number of Images", 1, 8, 1,
+                key="replicate_num_images",
+                help="All predictions are submitted at once and Replicate runs them in parallel; images appear as they finish."
+            )
+            use_cache = st.checkbox("♻️ Reuse cached image for identical settings", value=False, key="replicate_use_cache")
+            backup_keys = {"DALL·E": openai_api_key, "Stable Diffusion": stability_api_key}
+            hedge_options = [name for name, key in backup_keys.items() if key]
+            hedge_generator = None
+            if num_images == 1 and hedge_options and st.checkbox(
+                "⚡ Hedge with a backup provider if Flux is slow",
+                value=False,
+                key="replicate_hedge",
+                help="If Flux takes longer than its recent 95th percentile, the prompt is also sent to the backup and the first image wins."
+            ):
+                hedge_generator = st.selectbox("Backup provider", hedge_options, key="replicate_hedge_generator")
 
             if st.button("✨ Generate Image with Replicate AI"):
                 if not prompt:
                     st.error("❗ Please enter a prompt.")
                     st.stop()
 
-                with st.spinner("🔄 Generating image..."):
+                def show_replicate_image(image):
+                    image_path = f"replicate_image_{len(st.session_state.generations)+1}.{output_format}"
+                    image.save(image_path)
+                    store_generated_image(image)
+                    st.session_state.generations.append({
+                        "id": f"replicate_{len(st.session_state.generations)+1}",
+                        "type": "image",
+                        "path": image_path,
+                        "source": "Replicate AI",
+                        "prompt": prompt,
+                        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
+                    })
+                    st.image(image.data, caption=f"Image {len(st.session_state.generated_images)}", use_column_width=True)
+
+                with st.spinner("🔄 Generating image..." if num_images == 1 else f"🔄 Generating {num_images} images..."):
                     try:
-                        image = generate_image_from_text_flux(
-                            prompt,
-                            aspect_ratio=aspect_ratio,
-                            output_format=output_format,
-                            output_quality=output_quality,
-                            safety_tolerance=safety_tolerance,
-                            prompt_upsampling=prompt_upsampling
-                        )
-                        if image:
-                            image_path = f"replicate_image_{len(st.session_state.generations)+1}.{output_format}"
-                            image.save(image_path)
-                            st.session_state.generated_images.append(image)
-                            st.session_state.generations.append({
-                                "id": f"replicate_{len(st.session_state.generations)+1}",
-                                "type": "image",
-                                "path": image_path,
-                                "source": "Replicate AI",
-                                "prompt": prompt,
-                                "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
-                            })
-
-                            st.image(image, caption=f"Image {len(st.session_state.generated_images)}", use_column_width=True)
-                            st.success("✅ Image generated and saved to history.")
+                        def generate_flux():
+                            return cached_image(
+                                use_cache, "replicate", "flux-1.1-pro", prompt,
+                                {
+                                    "aspect_ratio": aspect_ratio,
+                                    "output_format": output_format,
+                                    "output_quality": output_quality,
+                                    "safety_tolerance": safety_tolerance,
+                                    "prompt_upsampling": prompt_upsampling
+                                },
+                                lambda: generate_image_from_text_flux(
+                                    prompt,
+                                    aspect_ratio=aspect_ratio,
+                                    output_format=output_format,
+                                    output_quality=output_quality,
+                                    safety_tolerance=safety_tolerance,
+                                    prompt_upsampling=prompt_upsampling,
+                                    report=report
+                                )
+                            )
+
+                        if num_images > 1:
+                            images = generate_images_from_text_flux(
+                                prompt, num_images,
+                                aspect_ratio=aspect_ratio,
+                                output_format=output_format,
+                                output_quality=output_quality,
+                                safety_tolerance=safety_tolerance,
+                                prompt_upsampling=prompt_upsampling,
+                                use_cache=use_cache,
+                                report=report
+                            )
+                            generated = 0
+                            try:
+                                for image in images:
+                                    show_replicate_image(image)
+                                    generated += 1
+                            finally:
+                                # Cancels the predictions still running if the run is stopped
+                                images.close()
+                            if generated:
+                                st.success(f"✅ {generated} of {num_images} images generated and saved to history.")
+                            else:
+                                st.error("❌ Failed to generate images.")
                         else:
-                            st.error("❌ Failed to generate image.")
+                            if hedge_generator:
+                                api_keys = {"openai": openai_api_key, "stability": stability_api_key}
+                                image = generate_image_hedged(
+                                    "Flux", generate_flux, hedge_generator,
+                                    lambda: generate_image(hedge_generator, prompt, {"aspect_ratio": aspect_ratio}, api_keys, report),
+                                    aspect_ratio,
+                                    initializer=attach_script_context()
+                                )
+                            else:
+                                image = generate_flux()
+                            if image:
+                                show_replicate_image(image)
+                                st.success("✅ Image generated and saved to history.")
+                            else:
+                                st.error("❌ Failed to generate image.")
 
                     except Exception as e:
                         st.error(f"❗ An error occurred: {e}")
@@ -865,7 +734,13 @@ def main():
                     st.stop()
                 try:
                     st.success("🔄 Initiating RunwayML video generation...")
-                    generate_video_runwayml(runway_api_key, prompt_image_url, prompt_text)
+                    video_path = generate_video_runwayml(
+                        runway_api_key, prompt_image_url, prompt_text, report=report, job_store=job_store, owner=owner
+                    )
+                    if video_path:
+                        st.session_state.generated_videos.append(video_path)
+                        st.session_state.final_video = video_path
+                        st.video(video_path)
                 except Exception as e:
                     st.error(f"❗ An unexpected error occurred with RunwayML: {e}")
                     st.error(traceback.format_exc())
@@ -882,10 +757,10 @@ def main():
             # Camera Motions
             st.markdown("### 🎥 Camera Motion")
             try:
-                supported_camera_motions = luma_client.generations.camera_motion.list()
+                supported_camera_motions = luma_camera_motions(luma_api_key)
                 camera_motion = st.selectbox("Select Camera Motion", ["None"] + supported_camera_motions, key="luma_camera_motion")
-                if camera_motion != "None":
-                    prompt = f"{prompt}, {camera_motion}"
+                if camera_motion == "None":
+                    camera_motion = None
             except Exception as e:
                 st.error(f"🚫 Could not fetch camera motions: {e}")
                 camera_motion = None
@@ -939,41 +814,14 @@ def main():
 
                 try:
                     with st.spinner("🔄 Generating video with Luma AI..."):
-                        # Prepare generation parameters
-                        generation_params = {
-                            "prompt": prompt,
-                            "aspect_ratio": aspect_ratio,
-                            "loop": loop,
-                        }
-
-                        if keyframes:
-                            generation_params["keyframes"] = keyframes
-
-                        generation = luma_client.generations.create(**generation_params)
-                        completed = False
-                        while not completed:
-                            generation = luma_client.generations.get(id=generation.id)
-                            if generation.state == "completed":
-                                completed = True
-                            elif generation.state == "failed":
-                                st.error(f"❌ Generation failed: {generation.failure_reason}")
-                                st.stop()
-                            else:
-                                st.write("⌛ Video generation in progress... Waiting for completion.")
-                                time.sleep(5)
-
-                        video_url = generation.assets.video
-
-                        # Download video
-                        response = requests.get(video_url)
-                        video_path = f"{generation.id}.mp4"
-                        with open(video_path, "wb") as f:
-                            f.write(response.content)
-
-                        st.session_state.generated_videos.append(video_path)
-                        st.session_state.final_video = video_path
-                        st.success(f"✅ Video generated and saved to {video_path}")
-                        st.video(video_path)
+                        generation_params = luma_generation_params(prompt, aspect_ratio, loop, camera_motion, keyframes)
+                        video_path = generate_video_luma(
+                            luma_api_key, generation_params, report=report, job_store=job_store, owner=owner
+                        )
+                        if video_path:
+                            st.session_state.generated_videos.append(video_path)
+                            st.session_state.final_video = video_path
+                            st.video(video_path)
 
                 except Exception as e:
                     st.error(f"❗ An error occurred: {e}")
@@ -986,15 +834,8 @@ def main():
         st.header("🖼️ Generated Images")
         if st.session_state.generated_images:
             st.write(f"### Total Images: {len(st.session_state.generated_images)}")
-            # Display images in a responsive grid
-            num_columns = 3
-            for i in range(0, len(st.session_state.generated_images), num_columns):
-                cols = st.columns(num_columns)
-                for j in range(num_columns):
-                    idx = i + j
-                    if idx < len(st.session_state.generated_images):
-                        with cols[j]:
-                            st.image(st.session_state.generated_images[idx], use_column_width=True, caption=f"Image {idx + 1}")
+            # Display a page of thumbnails in a responsive grid
+            display_images_in_grid(st.session_state.generated_images, columns=3)
         else:
             st.info("🎨 No images generated yet. Use the **Generator** tab to create images.")
 
@@ -1039,7 +880,16 @@ def main():
         if st.session_state.generated_images or st.session_state.generated_videos:
             with st.expander("📦 Download All Content (ZIP)"):
                 zip_path = create_zip_file(st.session_state.generated_images, st.session_state.generated_videos)
-                if zip_path:
+                static = st.get_option("server.enableStaticServing")
+                if zip_path and static and os.path.getsize(zip_path) <= MAX_STATIC_FILE_SIZE:
+                    # Streamlit's static file handler streams the archive from disk
+                    url = "app/static/" + os.path.relpath(zip_path, STATIC_DIR).replace(os.sep, "/")
+                    version = os.stat(zip_path).st_mtime_ns
+                    st.markdown(
+                        f'<a href="{url}?v={version}" download="generated_content.zip">📥 Download ZIP</a>',
+                        unsafe_allow_html=True
+                    )
+                elif zip_path:
                     with open(zip_path, "rb") as f:
                         st.download_button(
                             label="📥 Download ZIP",
@@ -1047,8 +897,6 @@ def main():
                             file_name="generated_content.zip",
                             mime="application/zip"
                         )
-                    # Optionally, remove the ZIP after download
-                    os.remove(zip_path)
         else:
             st.info("📦 No content available for ZIP download.")
 
@@ -0,0 +1,237 @@
+"""Generated media: encoded images in flight and a disk-backed store for results.
+
+Provider images travel through the pipeline as ``EncodedImage``: the bytes
+the provider sent, their format and size, with pixels decoded only when a
+consumer needs them (frame encoding, cropping) and re-encodings memoised per
+target format and size. Uploading, caching and storing an image therefore
+reuse the provider's bytes instead of decoding and re-encoding them.
+
+Each Streamlit session gets its own directory. Images are written once, and
+session state only keeps small ``MediaHandle`` records (path, size, format,
+hash), so server memory no longer grows with the number of images a session
+has generated. Streamlit does not say when a session ends, so session
+directories not used for ``SESSION_MAX_AGE`` seconds are removed whenever a
+new session starts.
+"""
+
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+
+from PIL import Image
+
+DEFAULT_MEDIA_DIR = os.path.join(tempfile.gettempdir(), "loom_media")
+SESSION_MAX_AGE = float(os.environ.get("LOOM_SESSION_MAX_AGE", 24 * 3600))
+THUMBNAIL_SIZE = (384, 384)
+
+
+def extension_for(format):
+    return "jpg" if format == "JPEG" else format.lower()
+
+
+def format_for_extension(extension):
+    extension = extension.lower().lstrip(".")
+    return "JPEG" if extension in ("jpg", "jpeg") else extension.upper()
+
+
+class EncodedImage:
+    """An image held as encoded bytes, decoded to a PIL image only on first use.
+
+    Build one from provider bytes with ``from_bytes`` (only the header is read)
+    or wrap a PIL image with ``from_image`` (encoded only if bytes are asked
+    for). ``encode`` returns the original bytes whenever they already match the
+    requested format and size, and memoises every other conversion.
+    """
+
+    def __init__(self, data=None, format=None, width=None, height=None, image=None):
+        self._data = data
+        self.format = format
+        self.width = width
+        self.height = height
+        self._image = image
+        self._encoded = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_bytes(cls, data):
+        with Image.open(io.BytesIO(data)) as header:
+            return cls(bytes(data), header.format, header.width, header.height)
+
+    @classmethod
+    def from_image(cls, image):
+        return cls(None, image.format or "PNG", image.width, image.height, image)
+
+    @classmethod
+    def open(cls, source):
+        """Wrap a PIL image, encoded bytes, a path or a file object (such as a Streamlit upload)."""
+        if isinstance(source, cls):
+            return source
+        if isinstance(source, Image.Image):
+            return cls.from_image(source)
+        if isinstance(source, (bytes, bytearray)):
+            return cls.from_bytes(source)
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, "rb") as f:
+                return cls.from_bytes(f.read())
+        return cls.from_bytes(source.read())
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+    @property
+    def data(self):
+        """The encoded bytes, in ``format``."""
+        if self._data is None:
+            self._data = self.encode(self.format)
+        return self._data
+
+    @property
+    def image(self):
+        """The decoded PIL image; decoded once, on first access, and kept."""
+        with self._lock:
+            if self._image is None:
+                self._image = self._decode()
+            return self._image
+
+    def _decode(self):
+        image = Image.open(io.BytesIO(self._data))
+        image.load()
+        return image
+
+    def encode(self, format="PNG", size=None):
+        """Return the image encoded as ``format``, resized to ``size`` if given."""
+        size = tuple(size) if size else self.size
+        if self._data is not None and format == self.format and size == self.size:
+            return self._data
+        key = (format, size)
+        encoded = self._encoded.get(key)
+        if encoded is None:
+            image = self.image if size == self.size else self.image.resize(size)
+            if format == "JPEG" and image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            buffer = io.BytesIO()
+            image.save(buffer, format=format)
+            encoded = self._encoded[key] = buffer.getvalue()
+        return encoded
+
+    def resized(self, size):
+        """This image at ``size``; itself when it already has that size."""
+        size = tuple(size)
+        if size == self.size:
+            return self
+        return EncodedImage(self.encode(self.format, size), self.format, *size)
+
+    def crop(self, box):
+        return EncodedImage.from_image(self.image.crop(box))
+
+    def convert(self, mode):
+        """A PIL copy in ``mode``; the pixels decoded for it are not kept, so frames fed to an encoder stay small."""
+        image = self._image if self._image is not None else self._decode()
+        return image.convert(mode)
+
+    def save(self, path):
+        """Write the image to ``path`` in the format its extension names."""
+        data = self.encode(format_for_extension(os.path.splitext(path)[1]) or self.format)
+        with open(path, "wb") as f:
+            f.write(data)
+
+
+@dataclass(frozen=True)
+class MediaHandle:
+    path: str
+    width: int
+    height: int
+    format: str
+    sha256: str
+
+    @property
+    def extension(self):
+        return extension_for(self.format)
+
+
+def remove_stale_dirs(base, max_age=SESSION_MAX_AGE, prefix=""):
+    """Delete the directories in ``base`` starting with ``prefix`` whose mtime is over ``max_age`` seconds old.
+
+    Only each directory's own mtime is read; its users bump it when they touch it.
+    """
+    if not os.path.isdir(base):
+        return
+    cutoff = time.time() - max_age
+    for entry in os.scandir(base):
+        if not entry.name.startswith(prefix) or not entry.is_dir(follow_symlinks=False):
+            continue
+        try:
+            if entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        except FileNotFoundError:
+            pass  # removed by another session starting at the same time
+
+
+class MediaStore:
+    def __init__(self, root=None):
+        if root is None:
+            base = os.environ.get("LOOM_MEDIA_DIR", DEFAULT_MEDIA_DIR)
+            remove_stale_dirs(base, prefix="session_")
+            os.makedirs(base, exist_ok=True)
+            root = tempfile.mkdtemp(prefix="session_", dir=base)
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+
+    def touch(self):
+        """Mark the store as in use so ``remove_stale_dirs`` keeps it.
+
+        Returns False when its directory had already been removed, along with
+        every image in it; it is then recreated empty.
+        """
+        try:
+            os.utime(self.root)
+            return True
+        except FileNotFoundError:
+            os.makedirs(self.root, exist_ok=True)
+            return False
+
+    def add_bytes(self, data, format, width, height):
+        """Store already-encoded image bytes and return their handle; identical content is stored once."""
+        digest = hashlib.sha256(data).hexdigest()
+        handle = MediaHandle(
+            path=os.path.join(self.root, f"{digest}.{extension_for(format)}"),
+            width=width,
+            height=height,
+            format=format,
+            sha256=digest,
+        )
+        if not os.path.exists(handle.path):
+            tmp_path = f"{handle.path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, handle.path)
+        return handle
+
+    def add_image(self, image):
+        """Store an ``EncodedImage``, PIL image or encoded image bytes, keeping the original format.
+
+        Encoded images are stored as they are; a PIL image is encoded once.
+        """
+        image = EncodedImage.open(image)
+        return self.add_bytes(image.data, image.format, image.width, image.height)
+
+    def thumbnail(self, handle, size=THUMBNAIL_SIZE):
+        """Return the path of a small JPEG preview of ``handle``, rendering it the first time it is asked for."""
+        path = os.path.join(self.root, "thumbnails", f"{handle.sha256}_{size[0]}x{size[1]}.jpg")
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with Image.open(handle.path) as image:
+                # Lets the JPEG decoder downscale while decoding
+                image.draft("RGB", size)
+                image = image.convert("RGB")
+                image.thumbnail(size)
+                tmp_path = f"{path}.tmp"
+                image.save(tmp_path, format="JPEG", quality=80)
+            os.replace(tmp_path, path)
+        return path
@@ -0,0 +1,197 @@
+"""Process-wide timing spans and counters showing where generation time goes.
+
+Every provider call, HTTP request, rate-limit wait, poll check and wait,
+download, frame extraction, concat, encode and ZIP update is timed as a span
+of a named stage (``span("download", host=...)``). Counters track bytes
+transferred, retries and cache hits. Stages and counters are kept per label
+set for the life of the process and shared by every Streamlit session, so
+they describe the server's real workload.
+
+Set ``LOOM_METRICS_FILE`` to have the Prometheus text exposition written there
+every ``LOOM_METRICS_INTERVAL`` seconds (default 15) and at exit, e.g. for the
+node_exporter textfile collector. The app's Performance panel reads the same
+data through ``snapshot``.
+"""
+
+import atexit
+import collections
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+PREFIX = "loom"
+# Histogram bucket bounds in seconds, from a cache hit to a slow video generation
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+RECENT_SPANS = 500
+DEFAULT_INTERVAL = 15.0
+
+
+class StageStats:
+    """Latency histogram of one stage and label set."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.errors = 0
+        self.buckets = [0] * len(BUCKETS)
+
+    def record(self, seconds, failed=False):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if failed:
+            self.errors += 1
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items() if value is not None))
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Metrics:
+    def __init__(self):
+        self._stages = {}
+        self._counters = {}
+        self._recent = collections.deque(maxlen=RECENT_SPANS)
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds, failed=False, **labels):
+        key = (stage, _label_key(labels))
+        with self._lock:
+            stats = self._stages.get(key)
+            if stats is None:
+                stats = self._stages[key] = StageStats()
+            stats.record(seconds, failed)
+            self._recent.append({
+                "stage": stage, "labels": dict(key[1]), "ended": time.time(), "seconds": seconds, "failed": failed,
+            })
+
+    @contextmanager
+    def span(self, stage, **labels):
+        """Time the enclosed block as one ``stage`` span; failures are counted and re-raised."""
+        started = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self.record(stage, time.perf_counter() - started, failed, **labels)
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def snapshot(self):
+        """Return ``{"stages": [...], "counters": [...], "recent": [...]}`` as plain dicts for display."""
+        with self._lock:
+            stages = [
+                {
+                    "stage": stage, "labels": dict(labels), "count": stats.count, "errors": stats.errors,
+                    "total_seconds": stats.total, "mean_seconds": stats.total / stats.count,
+                    "max_seconds": stats.max,
+                }
+                for (stage, labels), stats in self._stages.items()
+            ]
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in self._counters.items()
+            ]
+            recent = list(self._recent)
+        stages.sort(key=lambda row: row["total_seconds"], reverse=True)
+        counters.sort(key=lambda row: (row["name"], sorted(row["labels"].items())))
+        return {"stages": stages, "counters": counters, "recent": recent}
+
+    def render_prometheus(self):
+        """Return every stage and counter in the Prometheus text exposition format."""
+        with self._lock:
+            stages = sorted((key, stats.count, stats.total, stats.errors, list(stats.buckets))
+                            for key, stats in self._stages.items())
+            counters = sorted(self._counters.items())
+
+        name = f"{PREFIX}_stage_duration_seconds"
+        lines = [f"# HELP {name} Time spent per pipeline stage.", f"# TYPE {name} histogram"]
+        for (stage, labels), count, total, _, buckets in stages:
+            key = (("stage", stage),) + labels
+            cumulative = 0
+            for bound, hits in zip(BUCKETS, buckets):
+                cumulative += hits
+                lines.append(f"{name}_bucket{_format_labels(key, [('le', repr(bound))])} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_format_labels(key)} {total!r}")
+            lines.append(f"{name}_count{_format_labels(key)} {count}")
+
+        name = f"{PREFIX}_stage_errors_total"
+        lines += [f"# HELP {name} Stage spans that raised.", f"# TYPE {name} counter"]
+        for (stage, labels), _, _, errors, _ in stages:
+            lines.append(f"{name}{_format_labels((('stage', stage),) + labels)} {errors}")
+
+        seen = set()
+        for (counter, labels), value in counters:
+            name = f"{PREFIX}_{counter}_total"
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_file(self, path):
+        """Atomically replace ``path`` with the current Prometheus text."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp_path, path)
+
+
+def _start_file_writer(metrics, path, interval):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def run():
+        while True:
+            time.sleep(interval)
+            metrics.write_file(path)
+
+    threading.Thread(target=run, name="metrics-writer", daemon=True).start()
+    atexit.register(metrics.write_file, path)
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    """Return the process-wide metrics, writing them to ``LOOM_METRICS_FILE`` when it is set."""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics()
+            path = os.environ.get("LOOM_METRICS_FILE")
+            if path:
+                _start_file_writer(_metrics, path, float(os.environ.get("LOOM_METRICS_INTERVAL", DEFAULT_INTERVAL)))
+    return _metrics
+
+
+def span(stage, **labels):
+    return get_metrics().span(stage, **labels)
+
+
+def increment(name, amount=1, **labels):
+    get_metrics().increment(name, amount, **labels)
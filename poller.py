@@ -0,0 +1,96 @@
+"""Asyncio poller that waits on many in-flight provider generations at once.
+
+A single event loop runs in a daemon thread for the whole process. Each job
+is a ``check`` callable that returns ``PENDING`` while the provider is still
+working, returns the finished result, or raises to fail the job. Checks run
+on a small thread pool only for the duration of the HTTP call; between checks
+a job is just a sleeping coroutine, so dozens of jobs cost no threads while
+they wait. Intervals start short and back off per job with jitter, so quick
+jobs are picked up promptly and slow ones are not hammered. Checks and the
+waits between them are recorded in ``metrics`` under the job's ``name``.
+"""
+
+import asyncio
+import concurrent.futures
+import random
+import threading
+
+import metrics
+
+PENDING = object()
+
+
+class JobFailed(Exception):
+    """Raised by a check when the provider reports the generation as failed."""
+
+
+class JobPoller:
+    def __init__(self, max_concurrent_checks=8):
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_concurrent_checks, thread_name_prefix="poller"
+        )
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="job-poller", daemon=True)
+        self._thread.start()
+
+    def submit(self, check, initial_interval=2.0, max_interval=15.0, backoff=1.5, jitter=0.2,
+               timeout=None, callback=None, name="job"):
+        """Start polling ``check`` and return a ``concurrent.futures.Future`` for its result.
+
+        ``callback``, if given, is called with the future once the job resolves.
+        A job that is still pending after ``timeout`` seconds fails with
+        ``TimeoutError``. Cancelling the future stops polling.
+        """
+        future = asyncio.run_coroutine_threadsafe(
+            self._poll(check, initial_interval, max_interval, backoff, jitter, timeout, name), self._loop
+        )
+        if callback is not None:
+            future.add_done_callback(callback)
+        return future
+
+    async def _poll(self, check, interval, max_interval, backoff, jitter, timeout, name):
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+
+        def timed_check():
+            with metrics.span("poll_check", provider=name):
+                return check()
+
+        while True:
+            result = await loop.run_in_executor(self._executor, timed_check)
+            if result is not PENDING:
+                return result
+            delay = interval * random.uniform(1 - jitter, 1 + jitter)
+            if deadline is not None:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise TimeoutError(f"Job still pending after {timeout} seconds")
+                delay = min(delay, remaining)
+            with metrics.span("poll_wait", provider=name):
+                await asyncio.sleep(delay)
+            interval = min(interval * backoff, max_interval)
+
+
+def generation_state_check(fetch):
+    """Build a check for SDK generations exposing ``state`` and ``failure_reason`` (RunwayML, Luma)."""
+    def check():
+        generation = fetch()
+        if generation.state == "completed":
+            return generation
+        if generation.state == "failed":
+            raise JobFailed(generation.failure_reason)
+        return PENDING
+    return check
+
+
+_poller = None
+_poller_lock = threading.Lock()
+
+
+def get_poller():
+    """Return the process-wide poller shared by every Streamlit session."""
+    global _poller
+    with _poller_lock:
+        if _poller is None:
+            _poller = JobPoller()
+    return _poller
@@ -0,0 +1,561 @@
+"""Provider adapters for the image and video services Loom talks to.
+
+Adapters never touch Streamlit: they return results and raise on failure
+(``httpx.HTTPError``, ``ProviderError``, ``JobFailed`` or the SDK's own errors),
+so the Streamlit UI and the headless batch runner drive the same code. Each
+generation request is timed as a ``provider_call`` span in ``metrics``.
+
+Providers are described by ``Adapter`` entries in a registry. The SDK an
+adapter needs (``replicate``, ``runwayml``, ``lumaai``) is imported by ``sdk``
+the first time that provider is used, so a server process whose sessions only
+call DALL·E or Stability never loads the others. SDK clients are kept per
+provider and API key by ``get_client``, so their connection pools survive
+reruns, and provider metadata lives in a shared ``TTLCache``.
+"""
+
+import base64
+import collections
+import hashlib
+import importlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+
+import httpx
+import metrics
+import ratelimit
+import transport
+from cache import TTLCache
+from downloads import download
+from media import EncodedImage
+from poller import PENDING, JobFailed, generation_state_check, get_poller
+
+logger = logging.getLogger(__name__)
+
+
+# Environment variables the headless runner and the job store read provider keys from
+API_KEY_ENV = {
+    "stability": "STABILITY_API_KEY",
+    "openai": "OPENAI_API_KEY",
+    "replicate": "REPLICATE_API_TOKEN",
+    "runwayml": "RUNWAYML_API_SECRET",
+    "luma": "LUMAAI_API_KEY",
+}
+
+
+def environment_api_keys():
+    """Return ``{provider: key}`` from ``API_KEY_ENV``; unset keys are empty strings."""
+    return {name: os.environ.get(variable, "") for name, variable in API_KEY_ENV.items()}
+
+
+class ProviderError(Exception):
+    """Raised when a provider answers without the result it was asked for."""
+
+
+@dataclass(frozen=True)
+class Adapter:
+    """How Loom reaches one provider.
+
+    ``sdk`` names the client module to import on first use (None for plain
+    HTTP through ``transport``), ``host`` is the API host rate limits are keyed
+    by, and ``client(module, api_key)`` builds an SDK client. Providers whose
+    generations are polled give their ``(initial, max)`` seconds between status
+    checks, and video providers a ``video_check(api_key, generation_id)``
+    poller check builder.
+    ``max_samples`` is how many images one text-to-image request can return.
+    """
+    name: str
+    host: str
+    sdk: str = None
+    client: object = None
+    poll_intervals: tuple = None
+    video_check: object = None
+    max_samples: int = 1
+
+
+# SDK clients kept for reuse; the least recently used beyond this are dropped
+MAX_CLIENTS = 64
+# Seconds provider metadata is reused before it is fetched again
+METADATA_TTL = 3600
+FLUX_MODEL = "black-forest-labs/flux-1.1-pro"
+# Take generated images from the API response itself where the provider allows
+# it, instead of downloading them from a URL in a second request
+INLINE_PAYLOADS = os.environ.get("LOOM_INLINE_PAYLOADS", "1") != "0"
+
+_adapters = {}
+_import_lock = threading.Lock()
+_sdks = {}
+_clients = collections.OrderedDict()
+_clients_lock = threading.Lock()
+_metadata = TTLCache(METADATA_TTL)
+
+
+def register_adapter(adapter):
+    """Add or replace the adapter for ``adapter.name``."""
+    _adapters[adapter.name] = adapter
+
+
+def get_adapter(name):
+    try:
+        return _adapters[name]
+    except KeyError:
+        raise ValueError(f"Unknown provider {name!r}") from None
+
+
+def sdk(name):
+    """Return the SDK module of provider ``name``, importing it (once per process) on first use."""
+    module_name = get_adapter(name).sdk
+    # Only fully imported modules are in _sdks; sys.modules holds a module
+    # while it is still being imported by another thread
+    module = _sdks.get(module_name)
+    if module is None:
+        # Serialized so concurrent first uses do not each pay for, or race on, the import
+        with _import_lock:
+            module = _sdks.get(module_name)
+            if module is None:
+                started = time.perf_counter()
+                module = importlib.import_module(module_name)
+                metrics.get_metrics().record("sdk_import", time.perf_counter() - started, provider=name)
+                _sdks[module_name] = module
+    return module
+
+
+def get_client(name, api_key):
+    """Return the shared SDK client of provider ``name`` for ``api_key``, creating it on first use.
+
+    Clients are thread-safe and hold their own connection pool, so one per
+    key serves every session and rerun.
+    """
+    factory = get_adapter(name).client
+    if factory is None:
+        raise ValueError(f"{name!r} has no SDK client")
+    # Keys are only kept hashed
+    key = (name, hashlib.sha256((api_key or "").encode("utf-8")).hexdigest())
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is not None:
+            _clients.move_to_end(key)
+            return client
+    client = factory(sdk(name), api_key)
+    with _clients_lock:
+        # Another thread may have built one meanwhile; keep the first
+        client = _clients.setdefault(key, client)
+        _clients.move_to_end(key)
+        while len(_clients) > MAX_CLIENTS:
+            # Not closed: a session may still be using it; its pool closes once it is collected
+            _clients.popitem(last=False)
+    return client
+
+
+def preload(names):
+    """Import the SDKs of providers ``names`` in a background thread, ahead of their first use."""
+    pending = [name for name in names if get_adapter(name).sdk and get_adapter(name).sdk not in _sdks]
+    if pending:
+        def run():
+            for name in pending:
+                sdk(name)
+
+        threading.Thread(target=run, name="sdk-preload", daemon=True).start()
+
+
+def image_to_bytes(image, format=None):
+    """Encoded bytes of ``image`` (an ``EncodedImage``, PIL image or encoded bytes), in its own format by default."""
+    image = EncodedImage.open(image)
+    return image.encode(format or image.format)
+
+
+def image_upload_bytes(image):
+    """PNG bytes to upload for ``image``; provider PNGs are passed through without re-encoding."""
+    return image_to_bytes(image, "PNG")
+
+
+def dalle_size_for_aspect_ratio(aspect_ratio):
+    if aspect_ratio == "16:9":
+        return "1792x1024"
+    if aspect_ratio == "9:16":
+        return "1024x1792"
+    return "1024x1024"
+
+
+def _admit(provider, api_key, timeout=None):
+    """Wait for the shared rate limiter before a call made through a provider SDK.
+
+    Raises TimeoutError when not admitted within ``timeout`` seconds.
+    """
+    host = get_adapter(provider).host
+    limiter = ratelimit.limiter(host, api_key)
+    if limiter is not None:
+        with metrics.span("rate_limit_wait", host=host):
+            limiter.acquire(timeout)
+
+
+def download_image(url):
+    """Stream an image to a temporary file through the download manager and return it as an ``EncodedImage``."""
+    fd, path = tempfile.mkstemp(suffix=".download")
+    os.close(fd)
+    try:
+        download(url, path)
+        return EncodedImage.open(path)
+    finally:
+        for leftover in (path, f"{path}.part"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+
+def read_file_output(output):
+    """Return a Replicate ``FileOutput`` as an ``EncodedImage`` without going through a temporary file.
+
+    Outputs returned inline as ``data:`` URLs are decoded without a request;
+    others are read in one GET through the shared transport.
+    """
+    if output.url.startswith("data:"):
+        return EncodedImage.from_bytes(output.read())
+    response = transport.get(output.url)
+    response.raise_for_status()
+    return EncodedImage.from_bytes(response.content)
+
+
+def generate_image_stability(api_key, prompt, seed=0):
+    return generate_images_stability(api_key, prompt, 1, seed)[0]
+
+
+def generate_images_stability(api_key, prompt, count, seed=0):
+    """Generate ``count`` images for one prompt, packing up to ``max_samples`` of them into each request.
+
+    A ``seed`` other than 0 (random) is offset per request so that requests do not repeat each other.
+    """
+    url = "https://api.stability.ai/v1beta/generation/stable-diffusion-v1-6/text-to-image"
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+    }
+    max_samples = get_adapter("stability").max_samples
+    images = []
+    for start in range(0, count, max_samples):
+        data = {
+            "text_prompts": [{"text": prompt}],
+            "cfg_scale": 7,
+            "height": 768,
+            "width": 768,
+            "samples": min(max_samples, count - start),
+            "steps": 30,
+            "seed": seed + start if seed else 0,
+        }
+        with metrics.span("provider_call", provider="stability", operation="text_to_image"):
+            response = transport.post(url, headers=headers, json=data)
+            response.raise_for_status()
+        images += [
+            EncodedImage.from_bytes(base64.b64decode(artifact['base64']))
+            for artifact in response.json()['artifacts']
+        ]
+    return images
+
+
+def _flux_input(prompt, aspect_ratio, output_format, output_quality, safety_tolerance, prompt_upsampling):
+    return {
+        "prompt": prompt,
+        "aspect_ratio": aspect_ratio,
+        "output_format": output_format,
+        "output_quality": output_quality,
+        "safety_tolerance": safety_tolerance,
+        "prompt_upsampling": prompt_upsampling
+    }
+
+
+def read_image_flux(output, inline=None):
+    """Return a Flux output as an ``EncodedImage``; ``inline`` (default ``INLINE_PAYLOADS``) reads it in memory."""
+    inline = INLINE_PAYLOADS if inline is None else inline
+    # An output sent inline as a data URL has nothing to download
+    if inline or output.url.startswith("data:"):
+        return read_file_output(output)
+    return download_image(output.url)
+
+
+def generate_image_flux(prompt, aspect_ratio="1:1", output_format="png", output_quality=80,
+                        safety_tolerance=2, prompt_upsampling=True, inline=None):
+    """Generate a Flux 1.1 Pro image; ``inline`` (default ``INLINE_PAYLOADS``) reads the output in memory."""
+    api_token = os.environ.get("REPLICATE_API_TOKEN", "")
+    client = get_client("replicate", api_token)
+    _admit("replicate", api_token)
+    with metrics.span("provider_call", provider="replicate", operation="text_to_image"):
+        output = client.run(
+            FLUX_MODEL,
+            input=_flux_input(prompt, aspect_ratio, output_format, output_quality, safety_tolerance, prompt_upsampling)
+        )
+    return read_image_flux(output, inline)
+
+
+def start_image_flux(prompt, aspect_ratio="1:1", output_format="png", output_quality=80,
+                     safety_tolerance=2, prompt_upsampling=True):
+    """Create a Flux 1.1 Pro prediction without waiting for it and return its id."""
+    api_token = os.environ.get("REPLICATE_API_TOKEN", "")
+    client = get_client("replicate", api_token)
+    _admit("replicate", api_token)
+    with metrics.span("provider_call", provider="replicate", operation="prediction_create"):
+        prediction = client.models.predictions.create(
+            model=FLUX_MODEL,
+            input=_flux_input(prompt, aspect_ratio, output_format, output_quality, safety_tolerance, prompt_upsampling)
+        )
+    return prediction.id
+
+
+def check_image_flux(api_token, prediction_id):
+    """Build a poller check for a Replicate image prediction that returns PENDING, then its output.
+
+    The output is not read here, so no poller thread is held by a download;
+    pass it to ``read_image_flux``.
+    """
+    client = get_client("replicate", api_token)
+
+    def check():
+        try:
+            _admit("replicate", api_token, timeout=0)
+        except TimeoutError:
+            return PENDING  # over the rate limit; check again on the next interval
+        try:
+            prediction = client.predictions.get(prediction_id)
+        except httpx.TransportError:
+            return PENDING  # a dropped connection says nothing about the prediction
+        except sdk("replicate").exceptions.ReplicateError as e:
+            # Rate limits and server errors are transient too; the poller's timeout bounds how long we keep trying
+            if e.status is None or e.status == 429 or e.status >= 500:
+                return PENDING
+            raise
+        if prediction.status == "succeeded":
+            return sdk("replicate").helpers.transform_output(prediction.output, client)
+        if prediction.status in ("failed", "canceled"):
+            raise JobFailed(prediction.error or f"Prediction {prediction_id} was {prediction.status}")
+        return PENDING
+
+    return check
+
+
+def cancel_prediction(api_token, prediction_id):
+    """Cancel a Replicate prediction; failures are logged, since the prediction is abandoned either way."""
+    try:
+        get_client("replicate", api_token).predictions.cancel(prediction_id)
+    except Exception:
+        logger.warning("Could not cancel Replicate prediction %s", prediction_id, exc_info=True)
+
+
+def submit_image_flux(prompt, aspect_ratio="1:1", output_format="png", output_quality=80,
+                      safety_tolerance=2, prompt_upsampling=True, timeout=300):
+    """Start a Flux prediction and return a poller future for its output, to read with ``read_image_flux``.
+
+    Many predictions can be in flight at once: none of them holds a thread
+    while Replicate works on it. Cancelling the future, the prediction
+    outliving ``timeout`` or its status checks failing cancels the prediction
+    at Replicate.
+    """
+    api_token = os.environ.get("REPLICATE_API_TOKEN", "")
+    prediction_id = start_image_flux(
+        prompt, aspect_ratio, output_format, output_quality, safety_tolerance, prompt_upsampling
+    )
+    initial_interval, max_interval = get_adapter("replicate").poll_intervals
+    job = get_poller().submit(
+        check_image_flux(api_token, prediction_id),
+        initial_interval=initial_interval,
+        max_interval=max_interval,
+        timeout=timeout,
+        name="replicate"
+    )
+
+    def abandoned(future):
+        # Unless it finished or Replicate reported it failed, the prediction may still be running and billed
+        if future.cancelled() or not isinstance(future.exception(), (type(None), JobFailed)):
+            cancel_prediction(api_token, prediction_id)
+
+    job.add_done_callback(abandoned)
+    return job
+
+
+def generate_image_dalle(api_key, prompt, size="1024x1024", quality="standard", inline=None):
+    """Return ``(image, revised_prompt)`` for a DALL·E 3 generation.
+
+    With ``inline`` (default ``INLINE_PAYLOADS``) the image comes base64-encoded
+    in the response instead of as a URL to download.
+    """
+    inline = INLINE_PAYLOADS if inline is None else inline
+    url = "https://api.openai.com/v1/images/generations"
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+    }
+    data = {
+        "model": "dall-e-3",
+        "prompt": prompt,
+        "n": 1,
+        "size": size,
+        "response_format": "b64_json" if inline else "url",
+        "quality": quality  # "standard" or "hd"
+    }
+    with metrics.span("provider_call", provider="openai", operation="text_to_image"):
+        response = transport.post(url, headers=headers, json=data)
+        response.raise_for_status()
+    result = response.json()['data'][0]
+    if inline:
+        image = EncodedImage.from_bytes(base64.b64decode(result['b64_json']))
+    else:
+        image = download_image(result['url'])
+    return image, result.get('revised_prompt', '')
+
+
+def start_video_stability(api_key, image, cfg_scale=1.8, motion_bucket_id=127, seed=0):
+    url = "https://api.stability.ai/v2beta/image-to-video"
+    headers = {
+        "Authorization": f"Bearer {api_key}"
+    }
+    files = {
+        "image": ("image.png", image_upload_bytes(image), "image/png")
+    }
+    data = {
+        "seed": str(seed),
+        "cfg_scale": str(cfg_scale),
+        "motion_bucket_id": str(motion_bucket_id)
+    }
+    with metrics.span("provider_call", provider="stability", operation="image_to_video"):
+        response = transport.post(url, headers=headers, files=files, data=data)
+        response.raise_for_status()
+    generation_id = response.json().get('id')
+    if not generation_id:
+        raise ProviderError("Stability AI did not return a generation id")
+    return generation_id
+
+
+def check_video_stability(api_key, generation_id):
+    url = f"https://api.stability.ai/v2beta/image-to-video/result/{generation_id}"
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Accept": "video/*"
+    }
+
+    def check():
+        try:
+            response = transport.get(url, headers=headers, poll=True)
+        except TimeoutError:
+            return PENDING  # over the rate limit; check again on the next interval
+        except httpx.TransportError:
+            return PENDING  # a dropped connection says nothing about the generation
+        # Rate limits and server errors are transient too; the poller's timeout bounds how long we keep trying
+        if response.status_code in (202, 429) or response.status_code >= 500:
+            return PENDING
+        response.raise_for_status()
+        return response.content
+
+    return check
+
+
+def wait_for_video_stability(api_key, generation_id, timeout=600):
+    """Block until a Stability video is ready and return its bytes; raises TimeoutError after ``timeout``."""
+    initial_interval, max_interval = get_adapter("stability").poll_intervals
+    job = get_poller().submit(
+        check_video_stability(api_key, generation_id),
+        initial_interval=initial_interval,
+        max_interval=max_interval,
+        timeout=timeout,
+        name="stability"
+    )
+    return job.result()
+
+
+def start_video_runwayml(api_key, prompt_image_url, prompt_text):
+    client = get_client("runwayml", api_key)
+    _admit("runwayml", api_key)
+    with metrics.span("provider_call", provider="runwayml", operation="image_to_video"):
+        response = client.image_to_video.create(
+            model="gen3a_turbo",
+            prompt_image=prompt_image_url,
+            prompt_text=prompt_text,
+        )
+    return response.id
+
+
+def start_video_luma(api_key, generation_params):
+    client = get_client("luma", api_key)
+    _admit("luma", api_key)
+    with metrics.span("provider_call", provider="luma", operation="generation"):
+        return client.generations.create(**generation_params).id
+
+
+def luma_camera_motions(api_key):
+    """Return the camera motions Luma supports, as prompt phrases; fetched at most once per ``METADATA_TTL``."""
+    return _metadata.get_or_create(
+        ("luma", "camera_motions"), lambda: get_client("luma", api_key).generations.camera_motion.list()
+    )
+
+
+def _video_url_check(fetch):
+    state_check = generation_state_check(fetch)
+
+    def check():
+        generation = state_check()
+        if generation is PENDING:
+            return PENDING
+        return generation.assets.video
+
+    return check
+
+
+def check_video_runwayml(api_key, generation_id):
+    client = get_client("runwayml", api_key)
+    return _video_url_check(lambda: client.image_to_video.get(id=generation_id))
+
+
+def check_video_luma(api_key, generation_id):
+    client = get_client("luma", api_key)
+    return _video_url_check(lambda: client.generations.get(id=generation_id))
+
+
+def video_check(provider, api_key, generation_id):
+    """Build a poller check for a video generation that returns PENDING, then the video bytes or URL."""
+    build = get_adapter(provider).video_check
+    if build is None:
+        raise ValueError(f"{provider!r} is not a video provider")
+    return build(api_key, generation_id)
+
+
+def generate_video_runwayml(api_key, prompt_image_url, prompt_text, output_path=None, on_started=None):
+    """Run a RunwayML image-to-video generation to completion and download it; returns the video path."""
+    generation_id = start_video_runwayml(api_key, prompt_image_url, prompt_text)
+    if on_started:
+        on_started(generation_id)
+    initial_interval, max_interval = get_adapter("runwayml").poll_intervals
+    job = get_poller().submit(
+        video_check("runwayml", api_key, generation_id),
+        initial_interval=initial_interval,
+        max_interval=max_interval,
+        name="runwayml"
+    )
+    return download(job.result(), output_path or f"runwayml_video_{generation_id}.mp4")
+
+
+def generate_video_luma(api_key, generation_params, output_path=None, on_started=None):
+    """Run a Luma generation to completion and download it; returns the video path."""
+    generation_id = start_video_luma(api_key, generation_params)
+    if on_started:
+        on_started(generation_id)
+    initial_interval, max_interval = get_adapter("luma").poll_intervals
+    job = get_poller().submit(
+        video_check("luma", api_key, generation_id),
+        initial_interval=initial_interval,
+        max_interval=max_interval,
+        name="luma"
+    )
+    return download(job.result(), output_path or f"{generation_id}.mp4")
+
+
+register_adapter(Adapter("stability", "api.stability.ai", poll_intervals=(5.0, 15.0),
+                         video_check=check_video_stability, max_samples=10))
+register_adapter(Adapter("openai", "api.openai.com"))
+register_adapter(Adapter("replicate", "api.replicate.com", sdk="replicate",
+                         client=lambda module, api_key: module.Client(api_token=api_key),
+                         poll_intervals=(1.0, 5.0)))
+register_adapter(Adapter("runwayml", "api.dev.runwayml.com", sdk="runwayml",
+                         client=lambda module, api_key: module.RunwayML(api_key=api_key),
+                         poll_intervals=(5.0, 15.0), video_check=check_video_runwayml))
+register_adapter(Adapter("luma", "api.lumalabs.ai", sdk="lumaai",
+                         client=lambda module, api_key: module.LumaAI(auth_token=api_key),
+                         poll_intervals=(3.0, 10.0), video_check=check_video_luma))
@@ -0,0 +1,167 @@
+"""Process-wide rate limiting of provider requests, shared by every Streamlit session.
+
+Each provider host and API key pair gets one token bucket, so sessions using
+the same key draw from the same budget. Waiting requests are admitted strictly
+in arrival order, so a session that queues a large batch cannot starve others
+that arrive later with a single request. When a provider still answers 429, the
+bucket stops admitting anyone until the ``Retry-After`` time (or an
+exponential backoff with jitter) has passed, and its rate is cut; successful
+requests then raise it back step by step towards the configured limit. That
+keeps sustained throughput close to the provider's actual limit instead of
+bursting into errors and backing off again.
+
+Limits can be overridden with ``LOOM_RATE_LIMITS``, e.g.
+``api.openai.com=0.2/3,api.stability.ai=10/10`` (requests per second / burst).
+"""
+
+import collections
+import email.utils
+import hashlib
+import os
+import random
+import threading
+import time
+
+# (requests per second, burst) per provider host. Stability allows 150 requests
+# per 10 seconds and Replicate 600 predictions per minute; the bursts are
+# sized so that no window ever exceeds those. OpenAI image limits depend on
+# the account tier, so it starts moderate and adapts to 429s.
+RATE_LIMITS = {
+    "api.stability.ai": (14.0, 10),
+    "api.openai.com": (0.5, 5),
+    "api.replicate.com": (9.5, 20),
+    "api.dev.runwayml.com": (1.0, 5),
+    "api.lumalabs.ai": (1.0, 5),
+}
+
+MAX_RETRIES = 5
+MAX_BACKOFF = 60.0
+# Rate is multiplied by this on a 429 and grows by this share of the limit per success
+DECREASE_FACTOR = 0.5
+INCREASE_STEP = 0.02
+
+
+def _parse_limits(value):
+    limits = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        host, _, spec = item.partition("=")
+        rate, _, burst = spec.partition("/")
+        limits[host.strip()] = (float(rate), int(burst or max(1, float(rate))))
+    return limits
+
+
+class RateLimiter:
+    """A token bucket with FIFO admission and adaptive rate."""
+
+    def __init__(self, rate, burst):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = rate / 50
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, timeout=None):
+        """Block until this caller may send one request; raises TimeoutError after ``timeout`` seconds."""
+        ticket = object()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._queue.append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    wait = None
+                    if self._queue[0] is ticket:
+                        if now >= self._blocked_until and self._tokens >= 1:
+                            self._tokens -= 1
+                            self._queue.popleft()
+                            self._cond.notify_all()
+                            return
+                        wait = max(self._blocked_until - now, (1 - self._tokens) / self.rate)
+                    if deadline is not None:
+                        remaining = deadline - now
+                        if remaining <= 0:
+                            raise TimeoutError("Timed out waiting for the provider rate limit")
+                        wait = remaining if wait is None else min(wait, remaining)
+                    self._cond.wait(wait)
+            except BaseException:
+                if ticket in self._queue:
+                    self._queue.remove(ticket)
+                    self._cond.notify_all()
+                raise
+
+    def backoff(self, delay):
+        """Hold every caller for ``delay`` seconds and slow the bucket down after a rate-limit answer."""
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            self._blocked_until = max(self._blocked_until, now + delay)
+            self._tokens = 0.0
+            self.rate = max(self.min_rate, self.rate * DECREASE_FACTOR)
+            self._cond.notify_all()
+
+    def succeeded(self):
+        """Let the rate recover towards the configured limit after an accepted request."""
+        if self.rate < self.max_rate:
+            with self._cond:
+                self._refill(time.monotonic())
+                self.rate = min(self.max_rate, self.rate + self.max_rate * INCREASE_STEP)
+
+
+def retry_after(response):
+    """Seconds to wait according to the response's ``Retry-After`` header, or None."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt):
+    """Exponential backoff with jitter for retry ``attempt`` (0-based)."""
+    return min(MAX_BACKOFF, 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+def should_retry(response):
+    """True for answers that mean "slow down" rather than "this request is wrong"."""
+    if response.status_code == 503:
+        return "Retry-After" in response.headers
+    if response.status_code != 429:
+        return False
+    # OpenAI also answers 429 when the account is out of credit; waiting does not help
+    return "insufficient_quota" not in response.text
+
+
+_limits = None
+_limiters = {}
+_lock = threading.Lock()
+
+
+def limiter(host, api_key=""):
+    """Return the shared limiter for ``host`` and ``api_key``, or None when the host is not limited."""
+    global _limits
+    with _lock:
+        if _limits is None:
+            _limits = dict(RATE_LIMITS, **_parse_limits(os.environ.get("LOOM_RATE_LIMITS", "")))
+        if host not in _limits:
+            return None
+        # Keys are only kept hashed
+        key = (host, hashlib.sha256((api_key or "").encode("utf-8")).hexdigest())
+        bucket = _limiters.get(key)
+        if bucket is None:
+            bucket = _limiters[key] = RateLimiter(*_limits[host])
+        return bucket
@@ -0,0 +1,148 @@
+"""Shared HTTP transport for every provider call.
+
+One pooled ``httpx.Client`` is kept per host for the life of the process, so
+repeated provider requests, polling loops and asset downloads reuse
+keep-alive (and, when the ``h2`` package is installed, HTTP/2) connections
+instead of opening a fresh TLS connection per request. Requests to provider
+APIs are admitted through the shared rate limiters in ``ratelimit``, and
+every request is timed and its response size counted in ``metrics``.
+"""
+
+import atexit
+import os
+import threading
+from urllib.parse import urlsplit
+
+import httpx
+
+import metrics
+import ratelimit
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Provider calls can take a while to answer; connecting should not.
+TIMEOUT = httpx.Timeout(connect=10.0, read=120.0, write=60.0, pool=30.0)
+
+DEFAULT_HOST_LIMIT = 16
+# Maximum open connections per host. Generation APIs get enough headroom for
+# parallel Snapshot runs; CDN hosts serving downloads share the default.
+HOST_LIMITS = {
+    "api.stability.ai": 32,
+    "api.openai.com": 16,
+    "api.replicate.com": 32,
+}
+
+KEEPALIVE_EXPIRY = 120.0
+
+
+def _parse_base_urls(value):
+    return dict(item.strip().split("=", 1) for item in value.split(",") if "=" in item)
+
+
+# Base URL replacing a provider host, e.g. to point Loom at local stand-in
+# servers: LOOM_API_BASE_URLS="api.stability.ai=http://127.0.0.1:8100"
+API_BASE_URLS = _parse_base_urls(os.environ.get("LOOM_API_BASE_URLS", ""))
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def resolve(url):
+    """Apply any ``API_BASE_URLS`` override to ``url``."""
+    parts = urlsplit(url)
+    base = API_BASE_URLS.get(parts.hostname or "")
+    if base is None:
+        return url
+    return base.rstrip("/") + parts.path + (f"?{parts.query}" if parts.query else "")
+
+
+def get_client(url):
+    """Return the shared client for the host of ``url``, creating it on first use."""
+    host = urlsplit(url).hostname or ""
+    client = _clients.get(host)
+    if client is None:
+        with _lock:
+            client = _clients.get(host)
+            if client is None:
+                limit = HOST_LIMITS.get(host, DEFAULT_HOST_LIMIT)
+                client = httpx.Client(
+                    http2=HTTP2_AVAILABLE,
+                    timeout=TIMEOUT,
+                    limits=httpx.Limits(
+                        max_connections=limit,
+                        max_keepalive_connections=limit,
+                        keepalive_expiry=KEEPALIVE_EXPIRY,
+                    ),
+                    follow_redirects=True,
+                )
+                _clients[host] = client
+    return client
+
+
+def _api_key(headers):
+    authorization = (headers or {}).get("Authorization", "")
+    return authorization.split(" ", 1)[-1]
+
+
+def request(method, url, poll=False, **kwargs):
+    """Send a request through the host's pooled client.
+
+    Requests to rate-limited provider hosts wait for the shared limiter of
+    their API key first, and 429 answers (or 503 with ``Retry-After``) are
+    retried after the delay the provider asks for, up to ``MAX_RETRIES`` times.
+    A ``poll`` request (a status check run on the poller's threads) never
+    waits: it raises TimeoutError when the limiter has no token right away,
+    and a 429 is returned after slowing the limiter down, for the caller to
+    check again on its next interval.
+    """
+    host = urlsplit(url).hostname or ""
+    limiter = ratelimit.limiter(host, _api_key(kwargs.get("headers")))
+    url = resolve(url)
+    client = get_client(url)
+    attempt = 0
+    while True:
+        if limiter is not None:
+            with metrics.span("rate_limit_wait", host=host):
+                limiter.acquire(0 if poll else None)
+        with metrics.span("http_request", host=host, method=method):
+            response = client.request(method, url, **kwargs)
+        metrics.increment("bytes_received", len(response.content), host=host)
+        if limiter is None:
+            return response
+        if not ratelimit.should_retry(response) or attempt >= ratelimit.MAX_RETRIES:
+            if response.status_code < 400:
+                limiter.succeeded()
+            return response
+        delay = ratelimit.retry_after(response)
+        limiter.backoff(ratelimit.backoff_delay(attempt) if delay is None else delay)
+        if poll:
+            return response
+        metrics.increment("retries", host=host, status=response.status_code)
+        response.close()
+        attempt += 1
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def stream(method, url, **kwargs):
+    """Context manager yielding a streaming response; the body is read on demand."""
+    url = resolve(url)
+    return get_client(url).stream(method, url, **kwargs)
+
+
+@atexit.register
+def close_all():
+    with _lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
@@ -0,0 +1,373 @@
+"""Video helpers that drive ffmpeg directly instead of going through MoviePy clips.
+
+Encodes, joins and frame extractions are timed in ``metrics``. OpenCV (and
+numpy with it) is imported inside the functions that read frames, so importing
+this module stays cheap.
+"""
+
+import hashlib
+import os
+import re
+import subprocess
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+
+import imageio_ffmpeg
+
+import metrics
+
+# Memory-backed scratch space for decoders that need a file name, when the host has one
+SCRATCH_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+# Threads for native renders; LOOM_FFMPEG_THREADS overrides the core count
+DEFAULT_THREADS = int(os.environ.get("LOOM_FFMPEG_THREADS", "0")) or os.cpu_count() or 1
+
+
+def ffmpeg_exe():
+    return imageio_ffmpeg.get_ffmpeg_exe()
+
+
+def encode_frames(frames, fps, output_path, codec="libx264", preset="medium"):
+    """Pipe PIL images from any iterable straight into an ffmpeg encoder.
+
+    Frames are written to ffmpeg's stdin as raw RGB as soon as the iterable
+    yields them, so a generator can still be producing images while the first
+    ones are already encoded, and only one frame is held in memory at a time.
+    Every frame is scaled to the size of the first one. Returns ``output_path``,
+    or None when the iterable produced no frames. Only the time spent encoding
+    is recorded, not the time spent waiting for the iterable.
+    """
+    process = None
+    size = None
+    encoding = 0.0
+    with tempfile.TemporaryFile() as log:
+        try:
+            for frame in frames:
+                frame = frame.convert("RGB")
+                if size is None:
+                    size = frame.size
+                    process = subprocess.Popen(
+                        [
+                            ffmpeg_exe(), "-y", "-loglevel", "error",
+                            "-f", "rawvideo", "-pix_fmt", "rgb24",
+                            "-s", f"{size[0]}x{size[1]}", "-r", str(fps),
+                            "-i", "-",
+                            # yuv420p needs even dimensions
+                            "-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2",
+                            "-c:v", codec, "-preset", preset, "-pix_fmt", "yuv420p",
+                            output_path,
+                        ],
+                        stdin=subprocess.PIPE,
+                        stdout=subprocess.DEVNULL,
+                        stderr=log,
+                    )
+                elif frame.size != size:
+                    frame = frame.resize(size)
+                started = time.perf_counter()
+                process.stdin.write(frame.tobytes())
+                encoding += time.perf_counter() - started
+        except BrokenPipeError:
+            pass
+        except BaseException:
+            if process is not None:
+                process.kill()
+                process.wait()
+            raise
+
+        if process is None:
+            return None
+        started = time.perf_counter()
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = process.wait()
+        encoding += time.perf_counter() - started
+        metrics.get_metrics().record("encode", encoding, returncode != 0, method="frames")
+        if returncode != 0:
+            log.seek(0)
+            raise RuntimeError(f"ffmpeg failed to encode {output_path}: {log.read().decode(errors='replace').strip()}")
+    return output_path
+
+
+def read_last_frame(path):
+    """Seek straight to the last frame of ``path`` with OpenCV and return it as a BGR array, or None."""
+    with metrics.span("frame_extraction"):
+        return _read_last_frame(path)
+
+
+def _read_last_frame(path):
+    import cv2
+
+    capture = cv2.VideoCapture(path)
+    try:
+        count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        # Container frame counts can overshoot by a frame or two; step back until one decodes
+        for index in range(count - 1, max(count - 10, 0) - 1, -1):
+            capture.set(cv2.CAP_PROP_POS_FRAMES, index)
+            ok, frame = capture.read()
+            if ok:
+                return frame
+        return None
+    finally:
+        capture.release()
+
+
+def last_frame_png(source):
+    """Return ``(png_bytes, width, height)`` for the last frame of a video path or in-memory video, or None.
+
+    In-memory videos are decoded from a scratch file in shared memory where
+    available, so the handoff never waits on the disk. PNG is written with
+    light compression since the bytes are uploaded straight away.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        with tempfile.NamedTemporaryFile(suffix=".mp4", dir=SCRATCH_DIR) as f:
+            f.write(source)
+            f.flush()
+            frame = read_last_frame(f.name)
+    else:
+        frame = read_last_frame(source)
+    if frame is None:
+        return None
+    import cv2
+
+    ok, encoded = cv2.imencode(".png", frame, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+    if not ok:
+        return None
+    height, width = frame.shape[:2]
+    return encoded.tobytes(), width, height
+
+
+@dataclass(frozen=True)
+class VideoInfo:
+    duration: float
+    fps: float
+    frames: int
+    codec: str
+    profile: str
+    pix_fmt: str
+    width: int
+    height: int
+    has_audio: bool
+
+    @property
+    def stream_signature(self):
+        """Parameters that must match for segments to be joined without re-encoding."""
+        return (self.codec, self.profile, self.pix_fmt, self.width, self.height, self.fps, self.has_audio)
+
+
+_DURATION_RE = re.compile(r"Duration: (\d+):(\d+):([\d.]+)")
+_VIDEO_RE = re.compile(
+    r"Video: (?P<codec>\w+)(?: \((?P<profile>[^)]*)\))?.*?, (?P<pix_fmt>\w+)(?:\([^)]*\))?, "
+    r"(?P<width>\d+)x(?P<height>\d+)"
+)
+_FPS_RE = re.compile(r"([\d.]+) (?:fps|tbr)")
+
+_probe_cache = {}
+_hash_cache = {}
+_probe_lock = threading.Lock()
+
+
+def _file_hash(path):
+    stat = os.stat(path)
+    stamp = (path, stat.st_size, stat.st_mtime_ns)
+    digest = _hash_cache.get(stamp)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        _hash_cache[stamp] = digest
+    return digest
+
+
+def _frame_count(path):
+    import cv2
+
+    capture = cv2.VideoCapture(path)
+    try:
+        return int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    finally:
+        capture.release()
+
+
+def probe(path):
+    """Return the ``VideoInfo`` of ``path``; results are cached per file content hash.
+
+    Raises ValueError when ffmpeg finds no decodable video stream.
+    """
+    digest = _file_hash(path)
+    with _probe_lock:
+        info = _probe_cache.get(digest)
+    if info is not None:
+        return info
+
+    result = subprocess.run(
+        [ffmpeg_exe(), "-hide_banner", "-i", path], capture_output=True, encoding="utf-8", errors="replace"
+    )
+    output = result.stderr
+    duration = _DURATION_RE.search(output)
+    video = _VIDEO_RE.search(output)
+    if duration is None or video is None:
+        raise ValueError(f"No video stream found in {path}")
+    fps = _FPS_RE.search(output[video.end():])
+    hours, minutes, seconds = duration.groups()
+    info = VideoInfo(
+        duration=int(hours) * 3600 + int(minutes) * 60 + float(seconds),
+        fps=float(fps.group(1)) if fps else 30.0,
+        frames=_frame_count(path),
+        codec=video.group("codec"),
+        profile=video.group("profile") or "",
+        pix_fmt=video.group("pix_fmt"),
+        width=int(video.group("width")),
+        height=int(video.group("height")),
+        has_audio="Audio:" in output,
+    )
+    with _probe_lock:
+        _probe_cache[digest] = info
+    return info
+
+
+def has_reordered_frames(path):
+    """True when the video stream of ``path`` stores frames out of display order (B-frames).
+
+    Reads only packet timestamps through a stream copy, so nothing is decoded.
+    Such segments cannot be trimmed exactly by ``concat_copy``.
+    """
+    result = subprocess.run(
+        [ffmpeg_exe(), "-loglevel", "error", "-i", path, "-map", "0:v:0", "-c", "copy", "-f", "framecrc", "-"],
+        capture_output=True,
+        encoding="utf-8",
+        errors="replace",
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to read packets of {path}: {result.stderr.strip()}")
+    last_pts = None
+    for line in result.stdout.splitlines():
+        if line.startswith("#"):
+            continue
+        # stream index, dts, pts, duration, size, checksum
+        pts = int(line.split(",")[2])
+        if last_pts is not None and pts < last_pts:
+            return True
+        last_pts = pts
+    return False
+
+
+def concat_copy(paths, output_path, trim_last_frame=True):
+    """Join videos with identical stream parameters using the ffmpeg concat demuxer and stream copy.
+
+    Nothing is decoded or re-encoded, so this runs at roughly I/O speed. With
+    ``trim_last_frame`` every segment but the last ends one frame early (using
+    its probed frame rate), dropping the frame the next segment starts from.
+    The demuxer cuts on decoding timestamps, which only matches display order
+    when the segments have no B-frames, so the output frame count is checked
+    and RuntimeError is raised when the trim was not exact; callers should
+    then fall back to re-encoding.
+    """
+    with metrics.span("concat", method="copy"):
+        return _concat_copy(paths, output_path, trim_last_frame)
+
+
+def _concat_copy(paths, output_path, trim_last_frame):
+    expected_frames = 0
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as listing:
+        for i, path in enumerate(paths):
+            info = probe(path)
+            expected_frames += info.frames
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            listing.write(f"file '{escaped}'\n")
+            if trim_last_frame and i < len(paths) - 1:
+                listing.write(f"outpoint {info.duration - 1 / info.fps:.6f}\n")
+                expected_frames -= 1
+    try:
+        result = subprocess.run(
+            [
+                ffmpeg_exe(), "-y", "-loglevel", "error",
+                "-f", "concat", "-safe", "0", "-i", listing.name,
+                "-c", "copy", "-movflags", "+faststart",
+                output_path,
+            ],
+            capture_output=True,
+            encoding="utf-8",
+            errors="replace",
+        )
+    finally:
+        os.remove(listing.name)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to concatenate into {output_path}: {result.stderr.strip()}")
+    frames = _frame_count(output_path)
+    if frames != expected_frames:
+        raise RuntimeError(f"Stream copy produced {frames} frames instead of {expected_frames}")
+    return output_path
+
+
+def _render(inputs, output_path, width, height, fps, threads):
+    """Encode ``(path, info, trim_last_frame, fade_in)`` inputs back to back through one filter graph."""
+    threads = threads or DEFAULT_THREADS
+    filters = []
+    sequence = []
+    for i, (path, info, trim_last_frame, fade_in) in enumerate(inputs):
+        end = info.duration - 1 / info.fps if trim_last_frame else info.duration
+        source = f"[{i}:v]trim=end={end:.6f},setpts=PTS-STARTPTS,scale={width}:{height},setsar=1,fps={fps}"
+        if fade_in > 0:
+            filters.append(f"{source},split[seg{i}][head{i}]")
+            filters.append(
+                f"[head{i}]trim=end={fade_in:.6f},setpts=PTS-STARTPTS,"
+                f"fade=t=in:st=0:d={fade_in:.6f}[fade{i}]"
+            )
+            sequence.append(f"[fade{i}]")
+        else:
+            filters.append(f"{source}[seg{i}]")
+        sequence.append(f"[seg{i}]")
+    filters.append(f"{''.join(sequence)}concat=n={len(sequence)}:v=1:a=0,format=yuv420p[out]")
+
+    command = [ffmpeg_exe(), "-y", "-loglevel", "error"]
+    for path, *_ in inputs:
+        command += ["-i", path]
+    command += [
+        "-filter_complex_threads", str(threads),
+        "-filter_complex", ";".join(filters),
+        "-map", "[out]",
+        "-c:v", "libx264", "-preset", "medium", "-threads", str(threads),
+        "-r", str(fps), "-movflags", "+faststart",
+        output_path,
+    ]
+    result = subprocess.run(command, capture_output=True, encoding="utf-8", errors="replace")
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to render {output_path}: {result.stderr.strip()}")
+    return output_path
+
+
+def render_concat(paths, output_path, crossfade_duration=0, threads=None, trim_last_frame=True):
+    """Re-encode segments into ``output_path`` with one ffmpeg filter graph in a single native pass.
+
+    Reproduces the MoviePy crossfade exactly: every segment but the last loses
+    its final frame, and before each following segment the first
+    ``crossfade_duration`` seconds of that segment are inserted fading in from
+    black, after which the segment plays in full. Segments are scaled to the
+    first one's size. ``threads`` (default ``DEFAULT_THREADS``) caps both the
+    filter graph and encoder threads. Video only; raises RuntimeError on failure.
+    """
+    infos = [probe(path) for path in paths]
+    inputs = [
+        (path, info, trim_last_frame and i < len(paths) - 1, crossfade_duration if i > 0 else 0)
+        for i, (path, info) in enumerate(zip(paths, infos))
+    ]
+    fps = max(info.fps for info in infos)
+    with metrics.span("concat", method="render"):
+        return _render(inputs, output_path, infos[0].width, infos[0].height, fps, threads)
+
+
+def render_segment(path, output_path, width, height, fps, fade_in=0, trim_last_frame=False, threads=None):
+    """Re-encode one segment exactly as ``render_concat`` would encode it inside a longer list.
+
+    Pieces rendered with the same size and fps share stream parameters, so
+    they can later be joined with ``concat_copy`` without another encode.
+    """
+    info = probe(path)
+    with metrics.span("encode", method="segment"):
+        return _render([(path, info, trim_last_frame, fade_in)], output_path, width, height, fps, threads)